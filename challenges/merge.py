@@ -1,58 +1,419 @@
+"""Bundle a bot package into the single file that CodinGame takes.
 
+    python merge.py spring_challenge_2021   # writes spring_challenge_2021.merge.py
+    python merge.py --all --watch           # every package of the repository, next to it, again on each change
+
+The modules of a package import each other by their bare names, like `from board import Board`. The bundle starts
+with the other imports, then has the modules the entry module needs, each after its dependencies, without the
+definitions nothing uses. Docstrings, asserts and debug() calls are stripped. An import cycle, a name defined by two
+modules or a bundle over the upload size limit is an error.
+
+A bundle records the hash of its sources and of merge.py, a package whose hash did not change is skipped. --all bundles
+the packages in parallel, --watch polls their sources and bundles them again when they change.
+
+A single file bot can also share a module with a package, between the lines
+    # BEGIN BUNDLED spring_challenge_2021/time_budget.py
+    # END BUNDLED
+--embed rewrites such blocks with the module after its imports, its path is relative to the bot. The bot must import
+what the module imports. --all also refreshes the blocks of every bot.
+    python merge.py --embed spring_challenge_2021.py
+"""
+import argparse
+import ast
+import hashlib
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+ENTRY_MODULE = 'main'
+SIZE_LIMIT = 100_000  # Characters of a CodinGame upload
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE_ROOTS = ('challenges', 'contests', 'puzzles')
+HASH_PATTERN = re.compile(r'# Content hash (\w+)')
+EMBED_PATTERN = re.compile(r'^(# BEGIN BUNDLED (\S+)[^\n]*\n)(.*?)^(# END BUNDLED)', re.DOTALL | re.MULTILINE)
+WATCH_PERIOD = 1.
+
+
+class BundleError(Exception):
+    pass
+
+
+def load_modules(directory):
+    return {path.stem: ast.parse(path.read_text(), str(path)) for path in sorted(directory.glob('*.py'))}
+
+
+def get_imported_modules(tree, local_modules):
+    """Local modules imported anywhere in tree."""
+    imported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imported.update(alias.name for alias in node.names if alias.name in local_modules)
+        elif isinstance(node, ast.ImportFrom):
+            if node.module in local_modules:
+                imported.add(node.module)
+            elif node.module is None:
+                imported.update(alias.name for alias in node.names if alias.name in local_modules)
+    return imported
+
+
+def order_modules(modules, entry):
+    """The modules entry depends on, each after its own dependencies, entry last."""
+    imports = {name: get_imported_modules(tree, modules) for name, tree in modules.items()}
+    order, done, stack = [], set(), []
+
+    def visit(name):
+        if name in done:
+            return
+        if name in stack:
+            cycle = stack[stack.index(name):] + [name]
+            raise BundleError(f'Import cycle: {" -> ".join(cycle)}')
+        stack.append(name)
+        for imported in sorted(imports[name]):
+            visit(imported)
+        stack.pop()
+        done.add(name)
+        order.append(name)
+
+    visit(entry)
+    return order
+
+
+def is_main_guard(node):
+    return (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+            and isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__')
+
+
+class Stripper(ast.NodeTransformer):
+    """Remove local imports, docstrings, asserts and debug() calls, refer to `import module` names directly."""
+
+    def __init__(self, local_modules):
+        self.local_modules = local_modules
+        self.module_aliases = set()
+
+    def visit_Import(self, node):
+        local = [alias for alias in node.names if alias.name in self.local_modules]
+        self.module_aliases.update(alias.asname or alias.name for alias in local)
+        node.names = [alias for alias in node.names if alias not in local]
+        return node if node.names else None
+
+    def visit_ImportFrom(self, node):
+        if node.module is None:
+            local = [alias for alias in node.names if alias.name in self.local_modules]
+            self.module_aliases.update(alias.asname or alias.name for alias in local)
+            node.names = [alias for alias in node.names if alias not in local]
+            return node if node.names else None
+        if node.module not in self.local_modules:
+            return node
+        # Every module shares the namespace of the bundle, only renamed names need an assignment
+        return [ast.Assign([ast.Name(alias.asname, ast.Store())], ast.Name(alias.name, ast.Load()))
+                for alias in node.names if alias.asname and alias.asname != alias.name] or None
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if isinstance(node.value, ast.Name) and node.value.id in self.module_aliases:
+            return ast.copy_location(ast.Name(node.attr, node.ctx), node)
+        return node
+
+    def visit_Assert(self, node):
+        return None
+
+    def visit_Expr(self, node):
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            return None  # Docstrings and other bare strings
+        if (isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name)
+                and node.value.func.id == 'debug'):
+            return None
+        return self.generic_visit(node)
+
+    def generic_visit(self, node):
+        super().generic_visit(node)
+        if not isinstance(node, ast.Module) and isinstance(getattr(node, 'body', None), list) and not node.body:
+            node.body = [ast.Pass()]
+        return node
+
+
+def get_defined_names(statement):
+    """Names a removable top-level statement defines, None if it must be kept for what it does."""
+    if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {statement.name}
+    if isinstance(statement, (ast.Import, ast.ImportFrom)):
+        if isinstance(statement, ast.ImportFrom) and statement.module == '__future__':
+            return None
+        return {(alias.asname or alias.name).split('.')[0] for alias in statement.names}
+    if isinstance(statement, (ast.Assign, ast.AnnAssign)):
+        targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+        names = set()
+        for target in targets:
+            for node in ast.walk(target):
+                if isinstance(node, ast.Name):
+                    names.add(node.id)
+                elif isinstance(node, (ast.Attribute, ast.Subscript)):
+                    return None
+        return names
+    return None
+
+
+def get_used_names(statement):
+    names = set()
+    for node in ast.walk(statement):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+    return names
+
+
+def remove_unused(statements):
+    """Keep the statements run for what they do and the definitions they need, transitively."""
+    defined_names = [get_defined_names(statement) for statement in statements]
+    kept = [names is None for names in defined_names]
+    needed = set()
+    for statement, is_kept in zip(statements, kept):
+        if is_kept:
+            needed |= get_used_names(statement)
+
+    changed = True
+    while changed:
+        changed = False
+        for index, (statement, names) in enumerate(zip(statements, defined_names)):
+            if not kept[index] and names & needed:
+                kept[index] = changed = True
+                needed |= get_used_names(statement)
+    return [statement for statement, is_kept in zip(statements, kept) if is_kept]
+
+
+def split_imports(statement):
+    """One statement per imported name, so that unused names can be dropped one by one."""
+    if isinstance(statement, ast.Import):
+        return [ast.Import([alias]) for alias in statement.names]
+    if isinstance(statement, ast.ImportFrom):
+        return [ast.ImportFrom(statement.module, [alias], statement.level) for alias in statement.names]
+    return [statement]
 
-IMPORT_PATTERN = re.compile(r'from (\w+) import|import (\w+)')
 
+def merge_imports(statements):
+    """Unique import lines, the future ones first, then the plain imports and the from imports."""
+    futures, imports, from_imports = set(), set(), {}
+    for statement in statements:
+        if isinstance(statement, ast.Import):
+            imports.add(ast.unparse(statement))
+        elif statement.module == '__future__':
+            futures.add(ast.unparse(statement))
+        else:
+            key = ('.' * statement.level) + (statement.module or '')
+            from_imports.setdefault(key, set()).update(ast.unparse(alias) for alias in statement.names)
+    lines = sorted(futures) + sorted(imports)
+    lines += [f'from {module} import {", ".join(sorted(names))}' for module, names in sorted(from_imports.items())]
+    return lines
 
-def order_imports(file_paths):
-    local_modules = {file.stem for file in file_paths}
-    imports = {}
-    nonlocal_imports = set()
-    for file_path in file_paths:
-        imports[file_path] = set()
-        with open(file_path) as file:
-            for line in file:
-                if match := IMPORT_PATTERN.match(line):
-                    module = match.group(1)
-                    if module in local_modules:
-                        imports[file_path].add(module)
-                    else:
-                        nonlocal_imports.add(line)
 
-    files_order = []
-    imported_modules = set()
-    while file_paths:
-        file_paths_ = []
-        for file_path in file_paths:
-            if imports[file_path] <= imported_modules:
-                files_order.append(file_path)
-                imported_modules.add(file_path.stem)
-            else:
-                file_paths_.append(file_path)
-        file_paths = file_paths_
+def check_names(modules):
+    definitions = {}
+    for name, tree in modules.items():
+        for statement in tree.body:
+            if isinstance(statement, (ast.Import, ast.ImportFrom)):
+                continue
+            for defined_name in get_defined_names(statement) or ():
+                definitions.setdefault(defined_name, []).append(name)
+    clashes = {name: owners for name, owners in definitions.items() if len(set(owners)) > 1}
+    if clashes:
+        raise BundleError('Defined by several modules: ' +
+                          ', '.join(f'{name} ({", ".join(owners)})' for name, owners in sorted(clashes.items())))
 
-    return sorted(nonlocal_imports), files_order
+
+def bundle(directory, entry=ENTRY_MODULE, content_hash=''):
+    """Source of the single file bot of the package in directory."""
+    modules = load_modules(directory)
+    if entry not in modules:
+        raise BundleError(f'No {entry}.py in {directory}')
+    order = order_modules(modules, entry)
+    modules = {name: modules[name] for name in order}
+    check_names(modules)
+
+    statements = []
+    for name, tree in modules.items():
+        if name != entry:
+            tree.body = [statement for statement in tree.body if not is_main_guard(statement)]
+        tree = ast.fix_missing_locations(Stripper(modules.keys()).visit(tree))
+        for statement in tree.body:
+            statements.extend(split_imports(statement))
+
+    statements = remove_unused(statements)
+    imports = [statement for statement in statements if isinstance(statement, (ast.Import, ast.ImportFrom))]
+    body = [statement for statement in statements if not isinstance(statement, (ast.Import, ast.ImportFrom))]
+    header = f'# Bundled from {directory.name}/ by merge.py, edit the package rather than this file.\n' \
+             f'# Content hash {content_hash}'
+    # A blank line around functions and classes, the bundle is still read in the CodinGame IDE
+    blocks = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+    body = [f'\n{ast.unparse(statement)}\n' if isinstance(statement, blocks) else ast.unparse(statement)
+            for statement in body]
+    return '\n'.join([header, *merge_imports(imports), *body]) + '\n'
+
+
+def get_module_body(path):
+    """Import lines of the module at path, and its source after them."""
+    source = path.read_text()
+    statements = ast.parse(source, str(path)).body
+    imports = [imported for statement in statements if isinstance(statement, (ast.Import, ast.ImportFrom))
+               for imported in split_imports(statement)]
+    body = [statement for statement in statements if not isinstance(statement, (ast.Import, ast.ImportFrom))]
+    if not body:
+        raise BundleError(f'{path} has nothing but imports')
+    start = min([body[0].lineno] + [decorator.lineno for decorator in getattr(body[0], 'decorator_list', ())])
+    return {ast.unparse(imported) for imported in imports}, ''.join(source.splitlines(keepends=True)[start - 1:])
+
+
+def embed(path):
+    """Rewrite the bundled blocks of the single file bot at path, return a report if it changed."""
+    source = path.read_text()
+    imports = {ast.unparse(imported) for statement in ast.parse(source, str(path)).body
+               if isinstance(statement, (ast.Import, ast.ImportFrom)) for imported in split_imports(statement)}
+
+    def replace(match):
+        module_imports, body = get_module_body(path.parent / match.group(2))
+        missing = module_imports - imports
+        if missing:
+            raise BundleError(f'{path} misses the imports of {match.group(2)}: {", ".join(sorted(missing))}')
+        return f'{match.group(1)}\n\n{body.strip()}\n\n\n{match.group(4)}'
+
+    embedded = EMBED_PATTERN.sub(replace, source)
+    if embedded == source:
+        return None
+    path.write_text(embedded)
+    return f'{path}: embedded {", ".join(match.group(2) for match in EMBED_PATTERN.finditer(source))}'
+
+
+def find_embedding_bots(root=ROOT):
+    """Single file bots with bundled blocks."""
+    paths = [path for package_root in PACKAGE_ROOTS for path in (root / package_root).rglob('*.py')]
+    return sorted(path for path in paths if '__pycache__' not in path.parts and path.name != Path(__file__).name
+                  and EMBED_PATTERN.search(path.read_text()))
+
+
+def embed_all(paths):
+    for path in paths:
+        try:
+            report = embed(path)
+        except (BundleError, OSError, SyntaxError) as error:
+            report = f'{path}: {error}'
+        if report:
+            print(report)
+
+
+def find_packages(root=ROOT):
+    """Directories of the package roots with an entry module."""
+    paths = [path for package_root in PACKAGE_ROOTS for path in (root / package_root).rglob(f'{ENTRY_MODULE}.py')]
+    return sorted(path.parent for path in paths if '__pycache__' not in path.parts)
+
+
+def get_targets(directories):
+    return [(directory, directory.with_name(f'{directory.name}.merge.py')) for directory in directories]
+
+
+def get_content_hash(directory, entry=ENTRY_MODULE):
+    content_hash = hashlib.sha256(Path(__file__).read_bytes())
+    content_hash.update(entry.encode())
+    for path in sorted(directory.glob('*.py')):
+        content_hash.update(path.name.encode())
+        content_hash.update(path.read_bytes())
+    return content_hash.hexdigest()[:16]
+
+
+def get_bundled_hash(output):
+    """Content hash written in the bundle, None if there is none."""
+    try:
+        with open(output) as file:
+            match = HASH_PATTERN.search(file.readline() + file.readline())
+    except OSError:
+        return None
+    return match.group(1) if match else None
+
+
+def write_bundle(directory, output, entry, content_hash):
+    """Bundle the package and return a report, raise BundleError if it fails or is over the size limit.
+
+    Nothing is written then, otherwise the hash in the header of the output would skip the package on the next run.
+    """
+    source = bundle(directory, entry, content_hash)
+    if len(source) > SIZE_LIMIT:
+        raise BundleError(f'{output} would be {len(source)} characters, over the upload limit of {SIZE_LIMIT}')
+    output.write_text(source)
+    return f'{output}: {len(source)} characters'
+
+
+def build(directory, output, entry=ENTRY_MODULE, content_hash=None):
+    """Report of the bundle of one package for the pool, errors included."""
+    try:
+        return write_bundle(directory, output, entry, content_hash or get_content_hash(directory, entry))
+    except (BundleError, SyntaxError) as error:
+        return f'{directory}: {error}'
+
+
+def build_changed(executor, targets, entry, content_hashes):
+    """Bundle in parallel the targets, directory and output, whose hash differs from content_hashes."""
+    futures = []
+    for directory, output in targets:
+        content_hash = get_content_hash(directory, entry)
+        if content_hash != content_hashes.get(directory):
+            content_hashes[directory] = content_hash
+            futures.append(executor.submit(build, directory, output, entry, content_hash))
+    for future in futures:
+        print(future.result())
+    return len(futures)
 
 
 def main():
-    directory = Path(sys.argv[1])
-    files = list(file for file in directory.iterdir() if file.name != '__pycache__')
-    nonlocal_imports, files_order = order_imports(files)
-
-    with open(f'{directory.name}.merge.py', 'w') as out_file:
-        for line in nonlocal_imports:
-            print(line, file=out_file, end='')
-        for file_path in files_order:
-            print(f'\n\n"""  {file_path.name}  """', file=out_file)
-            with open(file_path) as in_file:
-                for line in in_file:
-                    if IMPORT_PATTERN.match(line):
-                        print(f'# {line}', file=out_file, end='')
-                    else:
-                        print(f'{line}', file=out_file, end='')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', type=Path, nargs='?', help='Package of the bot')
+    parser.add_argument('--entry', default=ENTRY_MODULE, help='Module run by the bot')
+    parser.add_argument('--output', type=Path, help='Defaults to <directory name>.merge.py')
+    parser.add_argument('--all', action='store_true',
+                        help=f'Bundle every package of {", ".join(PACKAGE_ROOTS)} next to its directory')
+    parser.add_argument('--watch', action='store_true', help='Bundle again the packages that change, until Ctrl+C')
+    parser.add_argument('--workers', type=int, help='Processes bundling the packages in parallel')
+    parser.add_argument('--embed', type=Path, metavar='BOT', help='Rewrite the bundled blocks of a single file bot')
+    args = parser.parse_args()
+
+    if args.embed is not None:
+        try:
+            print(embed(args.embed) or f'{args.embed}: unchanged')
+        except BundleError as error:
+            sys.exit(str(error))
+        return
+
+    if args.all:
+        targets = get_targets(find_packages())
+    elif args.directory is not None:
+        targets = [(args.directory, args.output or Path(f'{args.directory.name}.merge.py'))]
+    else:
+        parser.error('give a directory or --all')
+
+    if not args.all and not args.watch:
+        directory, output = targets[0]
+        try:
+            print(write_bundle(directory, output, args.entry, get_content_hash(directory, args.entry)))
+        except BundleError as error:
+            sys.exit(str(error))
+        return
+
+    # The bundles on disk tell which packages are up to date
+    content_hashes = {directory: get_bundled_hash(output) for directory, output in targets}
+    embedding_bots = find_embedding_bots() if args.all else []
+    with ProcessPoolExecutor(args.workers) as executor:
+        embed_all(embedding_bots)
+        nb_built = build_changed(executor, targets, args.entry, content_hashes)
+        print(f'{nb_built} bundled, {len(targets) - nb_built} unchanged.')
+        while args.watch:
+            try:
+                time.sleep(WATCH_PERIOD)
+                if args.all:
+                    targets = get_targets(find_packages())  # Also picks up new packages
+                embed_all(embedding_bots)
+                build_changed(executor, targets, args.entry, content_hashes)
+            except KeyboardInterrupt:
+                break
 
 
 if __name__ == "__main__":
@@ -1,14 +1,19 @@
+import json
 import math
 import random
+import resource
 import sys
+import threading
+import zlib
+from array import array
 from collections import Counter
 from dataclasses import dataclass, field
 from enum import IntEnum
+from functools import cached_property
+from statistics import NormalDist
 from time import perf_counter_ns
 import gc
 
-gc.disable()
-
 
 @dataclass(frozen=True)
 class CubeCoord:
@@ -50,6 +55,10 @@ class Board:
     index_to_coordinates: dict = field(default_factory=dict)
     cells: list = field(default_factory=list)
     cells_at_dist: dict = field(default_factory=dict)
+    masks_at_dist: dict = field(default_factory=dict)
+    shadow_cells: list = field(default_factory=list)
+    shadow_masks: list = field(default_factory=list)
+    symmetries: list = field(default_factory=list)
 
     @staticmethod
     def get_board(size):
@@ -76,10 +85,42 @@ class Board:
             coord += DIRECTIONS[0]
 
         board.cells = [None] * (1 + 3 * size * (size + 1))
+        board.update_shadows()
+        board.update_symmetries()
 
         return board
 
+    def update_shadows(self):
+        # shadow_cells[direction][size][index] are the cells shadowed by a tree of that size on that index
+        nb_cells = len(self.index_to_coordinates)
+        self.shadow_cells = [[[()] * nb_cells for _ in range(MAX_TREE_SIZE + 1)] for _ in DIRECTIONS]
+        for direction_index, direction in enumerate(DIRECTIONS):
+            for index, coord in self.index_to_coordinates.items():
+                cells = []
+                for size in range(1, MAX_TREE_SIZE + 1):
+                    coord += direction
+                    if coord in self.coordinates_to_index:
+                        cells.append(self.coordinates_to_index[coord])
+                    self.shadow_cells[direction_index][size][index] = tuple(cells)
+        self.shadow_masks = [[[sum(1 << index for index in cells) for cells in cells_by_index]
+                              for cells_by_index in cells_by_size] for cells_by_size in self.shadow_cells]
+
+    def update_symmetries(self):
+        # symmetries[symmetry][index] is the image of the cell index by the 6 rotations, then the mirrored rotations
+        self.symmetries = []
+        for mirror in (False, True):
+            for rotation in range(6):
+                permutation = []
+                for index in range(len(self.index_to_coordinates)):
+                    coord = self.index_to_coordinates[index]
+                    x, y, z = (coord.x, coord.z, coord.y) if mirror else (coord.x, coord.y, coord.z)
+                    for _ in range(rotation):
+                        x, y, z = -z, -x, -y
+                    permutation.append(self.coordinates_to_index[CubeCoord(x, y, z)])
+                self.symmetries.append(tuple(permutation))
+
     def update_cells_at_dist(self):
+        # cells_at_dist[(origin, size)] are the usable cells a tree of that size on origin can seed, up to size away
         self.cells_at_dist = {(origin, dist): set() for origin in self.index_to_coordinates for dist in range(4)}
         for target in self.cells:
             if target.richness > 0:
@@ -87,8 +128,10 @@ class Board:
                 for origin in self.cells:
                     origin_coord = self.index_to_coordinates[origin.index]
                     dist = origin_coord.distance(target_coord)
-                    if dist <= 3:
-                        self.cells_at_dist[(origin.index, dist)].add(target.index)
+                    if dist > 0:
+                        for size in range(dist, 4):
+                            self.cells_at_dist[(origin.index, size)].add(target.index)
+        self.masks_at_dist = {key: sum(1 << index for index in cells) for key, cells in self.cells_at_dist.items()}
 
 
 @dataclass(frozen=True)
@@ -128,38 +171,104 @@ class ActionType(IntEnum):
     GROW = 3
 
 
-@dataclass(frozen=True)
-class Action:
-    type: ActionType
-    target: int = 0
-    origin: int = 0
+# Actions are small ints: type | target << 2 | origin << 8
+Action = int
 
-    def __str__(self):
-        if self.type is ActionType.WAIT:
-            return 'WAIT Zzz'
-        elif self.type is ActionType.SEED:
-            return f'SEED {self.origin} {self.target}'
-        else:
-            return f'{self.type.name} {self.target}'
 
-    @staticmethod
-    def from_string(string):
-        split = string.split(' ')
-        if split[0] == ActionType.WAIT.name:
-            return Action(ActionType.WAIT)
-        if split[0] == ActionType.SEED.name:
-            return Action(ActionType.SEED, int(split[2]), int(split[1]))
-        if split[0] == ActionType.GROW.name:
-            return Action(ActionType.GROW, int(split[1]))
-        if split[0] == ActionType.COMPLETE.name:
-            return Action(ActionType.COMPLETE, int(split[1]))
+def get_action(action_type, target=0, origin=0):
+    return action_type | target << 2 | origin << 8
 
-    def __lt__(self, other):
-        return (self.type, -self.target, self.origin) < (other.type, -other.target, other.origin)
 
+WAIT = get_action(ActionType.WAIT)
 
 GROW_COST = [1, 3, 7, 4]
 MAX_TREE_SIZE = 3
+NB_CELLS = 37
+USE_BITBOARD = True
+MAX_NODES = 100_000  # About 1.6 kB per node with its game state, measured with tracemalloc
+EVICTION_RATIO = 0.75  # Above that share of the capacity, the sweep also drops the least visited nodes
+SWEEP_RATIO = 0.5  # The table is swept for unreachable nodes once it is that full
+EVICTION_SAMPLES = 64  # Nodes sampled to find the number of visits below which the sweep evicts
+SWEEP_BATCH = 32  # Entries checked per playout, a few µs each
+UCB_VECTORIZE_THRESHOLD = 32  # Below this branching factor a Python loop beats numpy
+RESPONSE_TIME = 1E6  # To choose and print the action once the search stops
+# The input of a turn may wait that long for the pondering thread to hand the GIL and the core over, before the bot can
+# read the time. It is kept out of the budget of every turn after the first.
+HANDOFF_TIME = 5E6
+ENDGAME_DAY = 23  # The solve of day 22 rarely fits in its share of the turn
+MAX_ENDGAME_NODES = 20_000
+SIMPLEX_TOLERANCE = 1E-9
+ENDGAME_TIME_SHARE = 0.5  # Of the turn, MCTS gets the rest if the endgame is not solved by then
+TELEMETRY = None  # 'stderr' or the path of a file to append a JSON record of each turn to
+
+# A node with n visits considers its WIDENING_FACTOR * n ** WIDENING_EXPONENT + 1 best actions.
+# COMPLETE comes first in the prior from COMPLETE_PRIORITY_DAY on.
+# get_score expects PRODUCTION_RATIO of the current production to reach the players each day left.
+# BEGIN TUNED PARAMETERS, rewritten by spring_challenge_2021_tuner.py
+EXPLORATION_FACTOR = 7.45
+FIRST_TURN_MAX_DEPTH = 6
+MAX_DEPTH = 3
+WIDENING_FACTOR = 1.0
+WIDENING_EXPONENT = 0.33
+COMPLETE_PRIORITY_DAY = 12
+PRODUCTION_RATIO = 0.5
+# END TUNED PARAMETERS
+
+# Strings are only needed to read and write actions
+ACTION_TO_STRING = {WAIT: 'WAIT Zzz'}
+for _target in range(NB_CELLS):
+    ACTION_TO_STRING[get_action(ActionType.GROW, _target)] = f'GROW {_target}'
+    ACTION_TO_STRING[get_action(ActionType.COMPLETE, _target)] = f'COMPLETE {_target}'
+    for _origin in range(NB_CELLS):
+        ACTION_TO_STRING[get_action(ActionType.SEED, _target, _origin)] = f'SEED {_origin} {_target}'
+STRING_TO_ACTION = {string: action for action, string in ACTION_TO_STRING.items()}
+STRING_TO_ACTION['WAIT'] = WAIT
+
+
+def action_to_string(action):
+    return ACTION_TO_STRING[action]
+
+
+def action_from_string(string):
+    return STRING_TO_ACTION[string.strip()]
+
+
+def transform_action(action, permutation):
+    """The action on the cells mapped by permutation."""
+    if action & 3 == ActionType.WAIT:
+        return action
+    return get_action(action & 3, permutation[action >> 2 & 63], permutation[action >> 8])
+
+
+def get_zobrist_keys(count):
+    return [ZOBRIST_RANDOM.getrandbits(64) for _ in range(count)]
+
+
+# Scalars are hashed modulo the table sizes, the transposition table verifies the states on a hit.
+ZOBRIST_RANDOM = random.Random(2021)
+ZOBRIST_TREES = [get_zobrist_keys(NB_CELLS) for _ in range(2 * (MAX_TREE_SIZE + 1))]
+ZOBRIST_DORMANT = get_zobrist_keys(NB_CELLS)
+ZOBRIST_DAY = get_zobrist_keys(32)
+ZOBRIST_NUTRIENTS = get_zobrist_keys(32)
+ZOBRIST_SUNS = [get_zobrist_keys(256) for _ in range(2)]
+ZOBRIST_SCORES = [get_zobrist_keys(256) for _ in range(2)]
+ZOBRIST_WAITING = [get_zobrist_keys(2) for _ in range(2)]
+
+
+def get_zobrist_mask(mask, keys):
+    zobrist = 0
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        zobrist ^= keys[bit.bit_length() - 1]
+    return zobrist
+
+
+def get_zobrist_scalars(day, nutrients, suns, scores, waiting):
+    return (ZOBRIST_DAY[day & 31] ^ ZOBRIST_NUTRIENTS[nutrients & 31]
+            ^ ZOBRIST_SUNS[0][suns[0] & 255] ^ ZOBRIST_SUNS[1][suns[1] & 255]
+            ^ ZOBRIST_SCORES[0][scores[0] & 255] ^ ZOBRIST_SCORES[1][scores[1] & 255]
+            ^ ZOBRIST_WAITING[0][waiting[0]] ^ ZOBRIST_WAITING[1][waiting[1]])
 
 
 @dataclass(frozen=True)
@@ -178,29 +287,72 @@ class GameState:
             self.index_to_tree[tree.cell_index] = tree
             self.tree_count[(tree.is_mine, tree.size)] = self.tree_count.get((tree.is_mine, tree.size), 0) + 1
 
+    @cached_property
+    def zobrist(self):
+        zobrist = get_zobrist_scalars(self.day, self.nutrients, (self.player.sun, self.opponent.sun),
+                                      (self.player.score, self.opponent.score),
+                                      (self.player.is_waiting, self.opponent.is_waiting))
+        for tree in self.trees:
+            zobrist ^= ZOBRIST_TREES[(0 if tree.is_mine else 4) + tree.size][tree.cell_index]
+            if tree.is_dormant:
+                zobrist ^= ZOBRIST_DORMANT[tree.cell_index]
+        return zobrist
+
     def get_possible_actions(self, board):
         possible_actions = {
-            self.player: {Action(ActionType.WAIT)},
-            self.opponent: {Action(ActionType.WAIT)}
+            True: {WAIT},
+            False: {WAIT}
         }
 
         occupied_cells = self.index_to_tree.keys()
 
         for tree in self.trees:
             player = self.player if tree.is_mine else self.opponent
+            actions = possible_actions[tree.is_mine]
             if tree.is_dormant or player.is_waiting:
                 continue
             grow_cost = GROW_COST[tree.size] + self.tree_count[(tree.is_mine, tree.size + 1)]
             if tree.size < MAX_TREE_SIZE and player.sun >= grow_cost:
-                possible_actions[player].add(Action(ActionType.GROW, tree.cell_index))
+                actions.add(get_action(ActionType.GROW, tree.cell_index))
             if tree.size == MAX_TREE_SIZE and player.sun >= GROW_COST[tree.size]:
-                possible_actions[player].add(Action(ActionType.COMPLETE, tree.cell_index))
+                actions.add(get_action(ActionType.COMPLETE, tree.cell_index))
 
             if player.sun >= self.tree_count[(tree.is_mine, 0)]:
                 for seed_index in board.cells_at_dist[(tree.cell_index, tree.size)] - occupied_cells:
-                    possible_actions[player].add(Action(ActionType.SEED, seed_index, tree.cell_index))
-
-        return possible_actions
+                    actions.add(get_action(ActionType.SEED, seed_index, tree.cell_index))
+
+        return possible_actions[True], possible_actions[False]
+
+    def get_action_cost(self, action, is_mine):
+        action_type = action & 3
+        if action_type == ActionType.WAIT:
+            return 0
+        if action_type == ActionType.COMPLETE:
+            return GROW_COST[MAX_TREE_SIZE]
+        if action_type == ActionType.SEED:
+            return self.tree_count[(is_mine, 0)]
+        tree = self.index_to_tree[action >> 2 & 63]
+        return GROW_COST[tree.size] + self.tree_count[(is_mine, tree.size + 1)]
+
+    def may_reach(self, other):
+        """False when no sequence of actions leads from this state to the other one."""
+        if other.day < self.day or other.nutrients > self.nutrients:
+            return False
+        for is_mine, player, other_player in ((True, self.player, other.player),
+                                              (False, self.opponent, other.opponent)):
+            if other_player.score < player.score:
+                return False
+            if other.day == self.day and (other_player.sun > player.sun or player.is_waiting > other_player.is_waiting):
+                return False
+            if other_player.score == player.score:
+                # Nothing was completed, so every tree is still there with at least the same size
+                for tree in self.trees:
+                    if tree.is_mine != is_mine:
+                        continue
+                    other_tree = other.index_to_tree.get(tree.cell_index)
+                    if other_tree is None or other_tree.is_mine != is_mine or other_tree.size < tree.size:
+                        return False
+        return True
 
     def get_next_state(self, player_action: Action, opponent_action: Action, board):
         day = self.day
@@ -209,57 +361,60 @@ class GameState:
         player = self.player
         opponent = self.opponent
         nb_completed = 0
+        player_type, player_target, player_origin = player_action & 3, player_action >> 2 & 63, player_action >> 8
+        opponent_type, opponent_target, opponent_origin = (opponent_action & 3, opponent_action >> 2 & 63,
+                                                           opponent_action >> 8)
 
-        if (player_action.type == ActionType.SEED and opponent_action.type == ActionType.SEED
-                and player_action.target == opponent_action.target):
+        if (player_type == ActionType.SEED and opponent_type == ActionType.SEED
+                and player_target == opponent_target):
             # Both seed at the same place. Put origin trees to dormant.
-            origin_trees = set(self.index_to_tree[index] for index in (player_action.origin, opponent_action.origin))
+            origin_trees = set(self.index_to_tree[index] for index in (player_origin, opponent_origin))
             trees -= origin_trees
             trees |= {Tree(tree.cell_index, tree.size, tree.is_mine, True) for tree in origin_trees}
             return GameState(day, nutrients, trees, player, opponent)
 
         # Player
-        if player_action.type == ActionType.GROW:
-            tree = self.index_to_tree[player_action.target]
+        if player_type == ActionType.GROW:
+            tree = self.index_to_tree[player_target]
             trees -= {tree}
             trees |= {Tree(tree.cell_index, tree.size + 1, tree.is_mine, True)}
             cost = GROW_COST[tree.size] + self.tree_count[(tree.is_mine, tree.size + 1)]
             player = Player(player.is_player, player.sun - cost, player.score, player.is_waiting)
-        elif player_action.type == ActionType.SEED:
-            tree = self.index_to_tree[player_action.origin]
+        elif player_type == ActionType.SEED:
+            tree = self.index_to_tree[player_origin]
             trees -= {tree}
-            trees |= {Tree(tree.cell_index, tree.size, tree.is_mine, True), Tree(player_action.target, 0, True, True)}
+            trees |= {Tree(tree.cell_index, tree.size, tree.is_mine, True), Tree(player_target, 0, True, True)}
             cost = self.tree_count[(True, 0)]
             player = Player(player.is_player, player.sun - cost, player.score, player.is_waiting)
-        elif player_action.type == ActionType.COMPLETE:
-            tree = self.index_to_tree[player_action.target]
+        elif player_type == ActionType.COMPLETE:
+            tree = self.index_to_tree[player_target]
             trees -= {tree}
             nb_completed += 1
             score = nutrients + board.cells[tree.cell_index].richness
             player = Player(player.is_player, player.sun - 4, player.score + score, player.is_waiting)
-        elif player_action.type == ActionType.WAIT:
+        elif player_type == ActionType.WAIT:
             player = Player(player.is_player, player.sun, player.score, True)
 
         # Opponent
-        if opponent_action.type == ActionType.GROW:
-            tree = self.index_to_tree[opponent_action.target]
+        if opponent_type == ActionType.GROW:
+            tree = self.index_to_tree[opponent_target]
             trees -= {tree}
             trees |= {Tree(tree.cell_index, tree.size + 1, tree.is_mine, True)}
             cost = GROW_COST[tree.size] + self.tree_count[(tree.is_mine, tree.size + 1)]
             opponent = Player(opponent.is_player, opponent.sun - cost, opponent.score, opponent.is_waiting)
-        elif opponent_action.type == ActionType.SEED:
-            tree = self.index_to_tree[opponent_action.origin]
+        elif opponent_type == ActionType.SEED:
+            tree = self.index_to_tree[opponent_origin]
             trees -= {tree}
-            trees |= {Tree(tree.cell_index, tree.size, tree.is_mine, True), Tree(opponent_action.target, 0, True, True)}
+            trees |= {Tree(tree.cell_index, tree.size, tree.is_mine, True), Tree(opponent_target, 0, False, True)}
             cost = self.tree_count[(False, 0)]
             opponent = Player(opponent.is_player, opponent.sun - cost, opponent.score, opponent.is_waiting)
-        elif opponent_action.type == ActionType.COMPLETE:
-            tree = self.index_to_tree[opponent_action.target]
+        elif opponent_type == ActionType.COMPLETE:
+            tree = self.index_to_tree[opponent_target]
             trees -= {tree}
             nb_completed += 1
             score = nutrients + board.cells[tree.cell_index].richness
             opponent = Player(opponent.is_player, opponent.sun - 4, opponent.score + score, opponent.is_waiting)
-        elif opponent_action.type == ActionType.WAIT:
+        elif opponent_type == ActionType.WAIT:
             opponent = Player(opponent.is_player, opponent.sun, opponent.score, True)
 
         nutrients -= nb_completed
@@ -270,16 +425,11 @@ class GameState:
 
             if day < 24:
                 # Calculate shadows
-                shadows = {index: 0 for index in board.index_to_coordinates}
-                direction = DIRECTIONS[day % 6]
+                shadows = [0] * len(board.cells)
+                shadow_cells = board.shadow_cells[day % 6]
                 for tree in trees:
-                    coord = board.index_to_coordinates[tree.cell_index]
-                    for distance in range(1, tree.size + 1):
-                        coord += direction
-                        if coord not in board.coordinates_to_index:
-                            break
-                        shadows[board.coordinates_to_index[coord]] = max(tree.size,
-                                                                         shadows[board.coordinates_to_index[coord]])
+                    for index in shadow_cells[tree.size][tree.cell_index]:
+                        shadows[index] = max(tree.size, shadows[index])
 
                 # Reset trees
                 trees = frozenset(Tree(tree.cell_index, tree.size, tree.is_mine, False) for tree in trees)
@@ -311,8 +461,8 @@ class GameState:
                     opponent_tall_trees.append(tree)
 
         nb_day_left = 23 - self.day
-        player_sun = self.player.sun + player_production * nb_day_left // 2
-        opponent_sun = self.opponent.sun + opponent_production * nb_day_left // 2
+        player_sun = self.player.sun + int(player_production * nb_day_left * PRODUCTION_RATIO)
+        opponent_sun = self.opponent.sun + int(opponent_production * nb_day_left * PRODUCTION_RATIO)
         player_tall_trees = sorted(
             (self.nutrients + board.cells[tree.cell_index].richness, -tree.cell_index, tree) for tree in
             player_tall_trees)
@@ -334,125 +484,825 @@ class GameState:
         return player_score + player_sun // 3 - opponent_score - opponent_sun // 3
 
 
-@dataclass
-class SimulationNode:
-    player_action_to_explore: list
-    opponent_action_to_explore: list
+class BitboardGameState:
+    """Same rules as GameState, with the trees stored as bitmasks over the cell indexes.
+
+    trees[4 * player + size] holds the cells with a tree of that size, player 0 being us and 1 the opponent.
+    The Zobrist hash is updated by get_next_state from the cells and scalars each action changes.
+    """
+    __slots__ = ('day', 'nutrients', 'trees', 'dormant', 'suns', 'scores', 'waiting', 'zobrist')
+
+    def __init__(self, day, nutrients, trees, dormant, suns, scores, waiting, zobrist=None):
+        self.day = day
+        self.nutrients = nutrients
+        self.trees = trees
+        self.dormant = dormant
+        self.suns = suns
+        self.scores = scores
+        self.waiting = waiting
+        if zobrist is None:
+            zobrist = get_zobrist_scalars(day, nutrients, suns, scores, waiting)
+            zobrist ^= get_zobrist_mask(dormant, ZOBRIST_DORMANT)
+            for mask, keys in zip(trees, ZOBRIST_TREES):
+                zobrist ^= get_zobrist_mask(mask, keys)
+        self.zobrist = zobrist
 
-    total_visits: int = 0
-    player_explored_actions: dict = field(default_factory=dict)
-    opponent_explored_actions: dict = field(default_factory=dict)
+    @staticmethod
+    def from_game_state(game_state):
+        trees = [0] * 8
+        dormant = 0
+        for tree in game_state.trees:
+            bit = 1 << tree.cell_index
+            trees[(0 if tree.is_mine else 4) + tree.size] |= bit
+            if tree.is_dormant:
+                dormant |= bit
+        player, opponent = game_state.player, game_state.opponent
+        return BitboardGameState(game_state.day, game_state.nutrients, tuple(trees), dormant,
+                                 (player.sun, opponent.sun), (player.score, opponent.score),
+                                 (player.is_waiting, opponent.is_waiting))
+
+    def _get_key(self):
+        return self.day, self.nutrients, self.trees, self.dormant, self.suns, self.scores, self.waiting
+
+    def __eq__(self, other):
+        return (self.zobrist == other.zobrist and self.trees == other.trees and self.dormant == other.dormant
+                and self.day == other.day and self.nutrients == other.nutrients and self.suns == other.suns
+                and self.scores == other.scores and self.waiting == other.waiting)
+
+    def __hash__(self):
+        return self.zobrist
+
+    def __repr__(self):
+        return f'BitboardGameState{self._get_key()}'
+
+    def get_tree_size(self, offset, bit):
+        trees = self.trees
+        for size in range(MAX_TREE_SIZE + 1):
+            if trees[offset + size] & bit:
+                return size
 
-    def __init__(self, game_state, board):
-        possible_actions = game_state.get_possible_actions(board)
+    def get_possible_actions(self, board):
+        trees = self.trees
+        free_cells = ~(trees[0] | trees[1] | trees[2] | trees[3] | trees[4] | trees[5] | trees[6] | trees[7])
+        awake = ~self.dormant
+        possible_actions = ([WAIT], [WAIT])
 
-        def get_value(action):
-            richness = board.cells[action.target].richness
-            action_type = action.type
-            if game_state.day >= 12 and action.type == ActionType.COMPLETE:
-                action_type += 1
-            if action.type == ActionType.WAIT:
-                cost = 0
-            elif action.type == ActionType.COMPLETE:
-                cost = 4
-            elif action.type == ActionType.SEED:
-                cost = game_state.tree_count[(player.is_player, 0)]
-            else:
-                tree = game_state.index_to_tree[action.target]
-                cost = GROW_COST[tree.size] + game_state.tree_count[(player.is_player, tree.size + 1)]
-
-            rand = random.randint(0, 65535)
-            return richness, action_type, -cost, rand
-
-        player = game_state.player
-        self.player_action_to_explore = sorted(possible_actions[game_state.player], key=get_value)
-        player = game_state.opponent
-        self.opponent_action_to_explore = sorted(possible_actions[game_state.opponent], key=get_value)
-        # random.shuffle(self.player_action_to_explore)
-        # random.shuffle(self.opponent_action_to_explore)
-        self.player_explored_actions = {}
-        self.opponent_explored_actions = {}
-
-    def get_actions(self, exploration_factor):
-        if self.player_action_to_explore:
-            player_action = self.player_action_to_explore.pop()
-        else:
-            t = self.total_visits
-            player_action = max((w / n + exploration_factor * (math.log(t) / n) ** .5, action) for action, (w, n) in
-                                self.player_explored_actions.items())[1]
+        for player, actions in enumerate(possible_actions):
+            if self.waiting[player]:
+                continue
+            offset = 4 * player
+            sun = self.suns[player]
+            can_seed = sun >= trees[offset].bit_count()
+            for size in range(MAX_TREE_SIZE + 1):
+                if size < MAX_TREE_SIZE:
+                    can_grow = sun >= GROW_COST[size] + trees[offset + size + 1].bit_count()
+                    grow_type = ActionType.GROW
+                else:
+                    can_grow = sun >= GROW_COST[size]
+                    grow_type = ActionType.COMPLETE
+                mask = trees[offset + size] & awake
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    index = bit.bit_length() - 1
+                    if can_grow:
+                        actions.append(grow_type | index << 2)
+                    if can_seed:
+                        seeds = board.masks_at_dist[(index, size)] & free_cells
+                        while seeds:
+                            seed_bit = seeds & -seeds
+                            seeds ^= seed_bit
+                            actions.append(ActionType.SEED | (seed_bit.bit_length() - 1) << 2 | index << 8)
 
-        if self.opponent_action_to_explore:
-            opponent_action = self.opponent_action_to_explore.pop()
-        else:
-            t = self.total_visits
-            opponent_action = max((w / n + exploration_factor * (math.log(t) / n) ** .5, action) for action, (w, n) in
-                                  self.opponent_explored_actions.items())[1]
+        return possible_actions
+
+    def get_action_cost(self, action, is_mine):
+        action_type = action & 3
+        if action_type == ActionType.WAIT:
+            return 0
+        if action_type == ActionType.COMPLETE:
+            return GROW_COST[MAX_TREE_SIZE]
+        offset = 0 if is_mine else 4
+        if action_type == ActionType.SEED:
+            return self.trees[offset].bit_count()
+        size = self.get_tree_size(offset, 1 << (action >> 2 & 63))
+        return GROW_COST[size] + self.trees[offset + size + 1].bit_count()
+
+    def may_reach(self, other):
+        """False when no sequence of actions leads from this state to the other one."""
+        if other.day < self.day or other.nutrients > self.nutrients:
+            return False
+        for player in range(2):
+            if other.scores[player] < self.scores[player]:
+                return False
+            if other.day == self.day and (other.suns[player] > self.suns[player]
+                                          or self.waiting[player] > other.waiting[player]):
+                return False
+            if other.scores[player] == self.scores[player]:
+                # Nothing was completed, so every tree is still there with at least the same size
+                offset = 4 * player
+                at_least_size = 0
+                for size in range(MAX_TREE_SIZE, -1, -1):
+                    at_least_size |= other.trees[offset + size]
+                    if self.trees[offset + size] & ~at_least_size:
+                        return False
+        return True
+
+    def get_next_state(self, player_action: Action, opponent_action: Action, board):
+        day = self.day
+        nutrients = self.nutrients
+        old_trees = self.trees
+        trees = list(old_trees)
+        dormant = self.dormant
+        suns = list(self.suns)
+        scores = list(self.scores)
+        waiting = list(self.waiting)
+
+        if (player_action & 3 == ActionType.SEED and opponent_action & 3 == ActionType.SEED
+                and player_action >> 2 & 63 == opponent_action >> 2 & 63):
+            # Both seed at the same place. Put origin trees to dormant.
+            dormant |= (1 << (player_action >> 8)) | (1 << (opponent_action >> 8))
+            zobrist = self.zobrist ^ get_zobrist_mask(dormant ^ self.dormant, ZOBRIST_DORMANT)
+            return BitboardGameState(day, nutrients, old_trees, dormant, self.suns, self.scores, self.waiting, zobrist)
+
+        zobrist = self.zobrist ^ get_zobrist_scalars(day, nutrients, self.suns, self.scores, self.waiting)
+        nb_completed = 0
+        for player, action in enumerate((player_action, opponent_action)):
+            offset = 4 * player
+            action_type = action & 3
+            target = action >> 2 & 63
+            if action_type == ActionType.WAIT:
+                waiting[player] = True
+            elif action_type == ActionType.GROW:
+                bit = 1 << target
+                size = self.get_tree_size(offset, bit)
+                suns[player] -= GROW_COST[size] + old_trees[offset + size + 1].bit_count()
+                trees[offset + size] ^= bit
+                trees[offset + size + 1] |= bit
+                dormant |= bit
+                zobrist ^= ZOBRIST_TREES[offset + size][target] ^ ZOBRIST_TREES[offset + size + 1][target]
+            elif action_type == ActionType.SEED:
+                bit = 1 << target
+                suns[player] -= old_trees[offset].bit_count()
+                trees[offset] |= bit
+                dormant |= bit | (1 << (action >> 8))
+                zobrist ^= ZOBRIST_TREES[offset][target]
+            elif action_type == ActionType.COMPLETE:
+                bit = 1 << target
+                suns[player] -= GROW_COST[MAX_TREE_SIZE]
+                scores[player] += nutrients + board.cells[target].richness
+                trees[offset + MAX_TREE_SIZE] ^= bit
+                nb_completed += 1
+                zobrist ^= ZOBRIST_TREES[offset + MAX_TREE_SIZE][target]
+
+        nutrients -= nb_completed
+
+        # New day
+        if waiting[0] and waiting[1]:
+            day += 1
+
+            if day < 24:
+                # Calculate shadows: shadowed[size] holds the cells in the shadow of a tree of at least that size
+                shadowed = [0] * (MAX_TREE_SIZE + 2)
+                shadow_masks = board.shadow_masks[day % 6]
+                for size in range(MAX_TREE_SIZE, 0, -1):
+                    shadow = shadowed[size + 1]
+                    masks = shadow_masks[size]
+                    mask = trees[size] | trees[4 + size]
+                    while mask:
+                        bit = mask & -mask
+                        mask ^= bit
+                        shadow |= masks[bit.bit_length() - 1]
+                    shadowed[size] = shadow
+
+                # Gain sun, reset trees and wake up players
+                for player in range(2):
+                    offset = 4 * player
+                    suns[player] += sum(size * (trees[offset + size] & ~shadowed[size]).bit_count()
+                                        for size in range(1, MAX_TREE_SIZE + 1))
+                dormant = 0
+                waiting = [False, False]
+
+        zobrist ^= get_zobrist_mask(dormant ^ self.dormant, ZOBRIST_DORMANT)
+        zobrist ^= get_zobrist_scalars(day, nutrients, suns, scores, waiting)
+        return BitboardGameState(day, nutrients, tuple(trees), dormant, tuple(suns), tuple(scores), tuple(waiting),
+                                 zobrist)
+
+    def get_score(self, board):
+        player_score, opponent_score = self.scores
+        player_sun, opponent_sun = self.suns
+        if self.day >= 24:
+            return player_score + player_sun // 3 - opponent_score - opponent_sun // 3
+
+        trees = self.trees
+        nb_day_left = 23 - self.day
+        player_production = trees[1].bit_count() + 2 * trees[2].bit_count() + 3 * trees[3].bit_count()
+        opponent_production = trees[5].bit_count() + 2 * trees[6].bit_count() + 3 * trees[7].bit_count()
+        player_sun += int(player_production * nb_day_left * PRODUCTION_RATIO)
+        opponent_sun += int(opponent_production * nb_day_left * PRODUCTION_RATIO)
+
+        def get_tall_trees(mask):
+            tall_trees = []
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                index = bit.bit_length() - 1
+                tall_trees.append((self.nutrients + board.cells[index].richness, -index))
+            return sorted(tall_trees)
+
+        player_tall_trees = get_tall_trees(trees[3])
+        opponent_tall_trees = get_tall_trees(trees[7])
+
+        while player_sun >= 4 and player_tall_trees:
+            player_sun -= 4
+            player_score += player_tall_trees.pop()[0]
+
+        while opponent_sun >= 4 and opponent_tall_trees:
+            opponent_sun -= 4
+            opponent_score += opponent_tall_trees.pop()[0]
+
+        return player_score + player_sun // 3 - opponent_score - opponent_sun // 3
 
-        return player_action, opponent_action
+
+class ActionStatistics:
+    """Wins and visits of the actions of one player, stored in parallel arrays.
+
+    Actions are sorted by decreasing prior. The first nb_tried of them have been tried, UCB selects among those only.
+    With progressive widening, the next untried action is added once the node has enough visits, so that the dozens
+    of SEED actions of a mid-game node do not each cost a visit before the best ones are explored deeper. Wide
+    selections use one numpy argmax over views of the arrays.
+    """
+    __slots__ = ('actions', 'wins', 'visits', 'nb_tried', 'wins_view', 'visits_view')
+
+    def __init__(self, actions):
+        self.actions = array('H', actions)
+        self.wins = array('d', bytes(8 * len(actions)))
+        self.visits = array('d', self.wins)
+        self.nb_tried = 0
+        if len(actions) >= UCB_VECTORIZE_THRESHOLD:
+            import numpy
+            self.wins_view = numpy.frombuffer(self.wins)
+            self.visits_view = numpy.frombuffer(self.visits)
+        else:
+            self.wins_view = self.visits_view = None
+
+    def select(self, total_visits, log_total_visits, exploration_factor):
+        nb_tried = self.nb_tried
+        if nb_tried < len(self.actions) and nb_tried < WIDENING_FACTOR * total_visits ** WIDENING_EXPONENT + 1:
+            self.nb_tried += 1
+            return nb_tried
+
+        if nb_tried >= UCB_VECTORIZE_THRESHOLD:
+            import numpy
+            visits = self.visits_view[:nb_tried]
+            return int((self.wins_view[:nb_tried] / visits +
+                        exploration_factor * numpy.sqrt(log_total_visits / visits)).argmax())
+
+        wins, visits = self.wins, self.visits
+        best_ucb, best_index = -math.inf, 0
+        for index in range(nb_tried):
+            n = visits[index]
+            ucb = wins[index] / n + exploration_factor * (log_total_visits / n) ** .5
+            if ucb > best_ucb:
+                best_ucb, best_index = ucb, index
+        return best_index
 
     def get_best_action(self):
-        if len(self.player_explored_actions) == 0:
-            return self.player_explored_actions[-1]
+        wins, visits = self.wins, self.visits
+        best_index = max(range(self.nb_tried), key=lambda index: wins[index] / visits[index], default=0)
+        return self.actions[best_index]
+
+    def get_most_visited(self, nb_actions):
+        """Action, visits and mean result of the nb_actions most visited actions."""
+        wins, visits = self.wins, self.visits
+        indexes = sorted(range(self.nb_tried), key=visits.__getitem__, reverse=True)[:nb_actions]
+        return [(action_to_string(self.actions[index]), int(visits[index]),
+                 round(wins[index] / max(1., visits[index]), 3)) for index in indexes]
+
 
-        return max((w / n, action) for action, (w, n) in
-                   self.player_explored_actions.items())[1]
+class SimulationNode:
+    __slots__ = ('total_visits', 'player', 'opponent')
+
+    def __init__(self, game_state, board):
+        player_actions, opponent_actions = game_state.get_possible_actions(board)
+
+        def get_value(action):
+            richness = board.cells[action >> 2 & 63].richness
+            action_type = action & 3
+            if game_state.day >= COMPLETE_PRIORITY_DAY and action_type == ActionType.COMPLETE:
+                action_type += 1
+            cost = game_state.get_action_cost(action, is_mine)
+            return richness, action_type, -cost, random.random()
+
+        self.total_visits = 0
+        is_mine = True
+        self.player = ActionStatistics(sorted(player_actions, key=get_value, reverse=True))
+        is_mine = False
+        self.opponent = ActionStatistics(sorted(opponent_actions, key=get_value, reverse=True))
+
+    def get_actions(self, exploration_factor, player_index=None):
+        """Return the indices of the actions to explore for both players, ours is forced by player_index."""
+        total_visits = self.total_visits
+        log_total_visits = math.log(total_visits) if total_visits else 0.
+        if player_index is None:
+            player_index = self.player.select(total_visits, log_total_visits, exploration_factor)
+        return player_index, self.opponent.select(total_visits, log_total_visits, exploration_factor)
+
+    def get_best_action(self):
+        return self.player.get_best_action()
 
-    def update(self, player_action, opponent_action, result):
+    def update(self, player_index, opponent_index, result):
         self.total_visits += 1
-        w, n = self.player_explored_actions.get(player_action, (0, 0))
-        self.player_explored_actions[player_action] = (w + result, n + 1)
-        w, n = self.opponent_explored_actions.get(opponent_action, (0, 0))
-        self.opponent_explored_actions[opponent_action] = (w - result, n + 1)
+        self.player.wins[player_index] += result
+        self.player.visits[player_index] += 1
+        self.opponent.wins[opponent_index] -= result
+        self.opponent.visits[opponent_index] += 1
+
+
+class TranspositionTable:
+    """Simulation nodes keyed by the Zobrist hash of their game state.
+
+    Entries keep their game state to verify a hit. A colliding state replaces the previous entry.
+    Once the table is SWEEP_RATIO full, sweep() drops the entries the root cannot reach a batch at a time, so that
+    the search pays for it in its own time budget rather than between turns. Above EVICTION_RATIO of its capacity,
+    it also evicts the least visited entries, and a finished sweep starts over.
+    """
+
+    def __init__(self, capacity=MAX_NODES):
+        self.capacity = capacity
+        self.entries = {}
+        self.root_game_state = None
+        self.sweep_keys = []
+        self.sweep_index = 0
+        self.min_visits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_full(self):
+        return len(self.entries) >= self.capacity
+
+    def is_sweeping(self):
+        return self.sweep_index < len(self.sweep_keys)
+
+    def get(self, game_state):
+        entry = self.entries.get(game_state.zobrist)
+        if entry is not None and entry[0] == game_state:
+            return entry[1]
+        return None
+
+    def put(self, game_state, node):
+        self.entries[game_state.zobrist] = (game_state, node)
+
+    def start_sweep(self, root_game_state):
+        """Sweep the entries of the table again, against the new root."""
+        self.root_game_state = root_game_state
+        self.sweep_keys = list(self.entries)
+        self.sweep_index = 0
+        self.min_visits = self.get_min_visits()
+
+    def get_min_visits(self):
+        """Visits below which a node is evicted, so that at most about EVICTION_RATIO of the capacity remains.
+
+        The nodes tied with the sampled quantile are evicted too, most leaves share a single visit.
+        """
+        nb_evicted = len(self.entries) - self.capacity * EVICTION_RATIO
+        if nb_evicted <= 0:
+            return 0
+        samples = random.sample(self.sweep_keys, min(EVICTION_SAMPLES, len(self.sweep_keys)))
+        visits = sorted(self.entries[zobrist][1].total_visits for zobrist in samples)
+        return visits[int(nb_evicted / len(self.entries) * len(visits))] + 1
+
+    def sweep(self, nb_entries=SWEEP_BATCH):
+        """Check the next nb_entries of the sweep, if the table is full enough to need it."""
+        if len(self.entries) < self.capacity * SWEEP_RATIO:
+            return
+        if self.sweep_index >= len(self.sweep_keys):
+            if len(self.entries) < self.capacity * EVICTION_RATIO or self.root_game_state is None:
+                return
+            self.start_sweep(self.root_game_state)
+        entries, root_game_state, min_visits = self.entries, self.root_game_state, self.min_visits
+        end = self.sweep_index + nb_entries
+        for zobrist in self.sweep_keys[self.sweep_index:end]:
+            entry = entries.get(zobrist)
+            if entry is None or entry[0] == root_game_state:
+                continue
+            if entry[1].total_visits < min_visits or not root_game_state.may_reach(entry[0]):
+                del entries[zobrist]
+        self.sweep_index = end
+
+
+# BEGIN BUNDLED spring_challenge_2021/time_budget.py by merge.py --embed, edit that module rather than this block
+
+
+class TimeBudget:
+    """Tell a search loop when to stop so that it answers before its deadline.
+
+    The cost of a batch of check_period iterations is learned online as an exponentially weighted mean and variance,
+    kept from one turn to the next. The loop stops once the next batch would overrun the deadline with a probability
+    above 1 - quantile. The clock is only read every check_period calls to is_over(), the cheap over attribute tells
+    the outer loops of a nested search that the inner one stopped.
+    """
+
+    def __init__(self, quantile=0.99, check_period=1, smoothing=0.1):
+        self.z_score = NormalDist().inv_cdf(quantile)
+        self.check_period = check_period
+        self.smoothing = smoothing
+        self.mean = None
+        self.variance = 0.
+        self.start()
+
+    def start(self, duration=math.inf, start_time=None):
+        """Start a turn of duration ns, from start_time if the clock started earlier than now."""
+        self.start_time = perf_counter_ns() if start_time is None else start_time
+        self.deadline = self.start_time + duration
+        self.last_time = self.start_time
+        self.countdown = 1  # The first call checks the clock
+        self.nb_checks = 0
+        self.over = False
+
+    def is_over(self):
+        """Call before each iteration. Return whether the loop must stop."""
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.check_period
+
+        now = perf_counter_ns()
+        if self.nb_checks:
+            self.add_sample(now - self.last_time)
+        self.nb_checks += 1
+        self.last_time = now
+        self.over = now + self.get_margin() > self.deadline
+        return self.over
+
+    def add_sample(self, cost):
+        if self.mean is None:
+            # A single sample says nothing of the spread, assume it is as large as the cost
+            self.mean, self.variance = cost, cost * cost
+            return
+        delta = cost - self.mean
+        self.mean += self.smoothing * delta
+        self.variance = (1 - self.smoothing) * (self.variance + self.smoothing * delta * delta)
+
+    def get_margin(self):
+        """Time to keep for the next batch of iterations."""
+        if self.mean is None:
+            return 0
+        return self.mean + self.z_score * math.sqrt(self.variance)
+
+    def log(self):
+        used = self.last_time - self.start_time
+        unused = self.deadline - self.last_time
+        cost = (self.mean or 0) / self.check_period
+        print(f'Used {used / 1E6:.1f} ms, {unused / 1E6:.1f} ms unused. '
+              f'Iteration cost {cost / 1E6:.3f} ms, margin {self.get_margin() / 1E6:.3f} ms.', file=sys.stderr)
+
+
+# END BUNDLED
+
+
+class SearchTelemetry:
+    """Counters and timers of the search of one turn, written as one JSON record.
+
+    lap() charges the time since the previous lap to a phase of the playouts: descending the tree (selection),
+    creating nodes (expansion), playing the actions (transition), scoring the leaf (evaluation) and updating the path
+    (backpropagation). Overhead is spent between playouts, checking the time budget and sweeping the table. Laps
+    cost a clock read per step, the bot only times its search when TELEMETRY is set.
+    """
+    PHASES = ('selection', 'expansion', 'transition', 'evaluation', 'backpropagation', 'overhead')
+
+    def __init__(self, day):
+        self.day = day
+        self.nb_simulations = 0
+        self.nb_nodes_created = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.times = dict.fromkeys(self.PHASES, 0)
+        self.last_time = perf_counter_ns()
+
+    def lap(self, phase):
+        now = perf_counter_ns()
+        self.times[phase] += now - self.last_time
+        self.last_time = now
+
+    def add_playout(self, depth):
+        self.nb_simulations += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def write(self, destination, **fields):
+        record = {
+            'day': self.day,
+            'simulations': self.nb_simulations,
+            'nodes_created': self.nb_nodes_created,
+            'mean_depth': round(self.total_depth / max(1, self.nb_simulations), 2),
+            'max_depth': self.max_depth,
+            'times_ms': {phase: round(time / 1E6, 3) for phase, time in self.times.items()},
+            **fields,
+        }
+        if destination == 'stderr':
+            print(json.dumps(record), file=sys.stderr)
+        else:
+            with open(destination, 'a') as file:
+                print(json.dumps(record), file=file)
+
+
+def solve_matrix_game(matrix):
+    """Value of a zero-sum matrix game for the row player, who maximizes, and an optimal mixed strategy.
+
+    Without a saddle point, the payoffs are shifted to be at least 1 and the column player's linear program, maximize
+    sum(y) subject to payoffs @ y <= 1 and y >= 0, is solved by a simplex on a dense tableau, with Bland's rule
+    against cycling. Its dual solution, read in the objective row of the last tableau, is the row strategy scaled by
+    sum(y), which is the inverse of the shifted value. The games of the last days are small, scipy would take most of
+    a second to import.
+    """
+    row_minima = [min(row) for row in matrix]
+    maximin = max(row_minima)
+    minimax = min(max(column) for column in zip(*matrix))
+    if maximin == minimax:
+        strategy = [0.] * len(matrix)
+        strategy[row_minima.index(maximin)] = 1.
+        return maximin, strategy
+
+    import numpy
+    payoffs = numpy.array(matrix, dtype=float)
+    shift = 1. - payoffs.min()
+    nb_rows, nb_columns = payoffs.shape
+    # Columns are the y variables, the slack variables of the rows and the right hand side, the last row is -sum(y)
+    tableau = numpy.zeros((nb_rows + 1, nb_columns + nb_rows + 1))
+    tableau[:nb_rows, :nb_columns] = payoffs + shift
+    tableau[:nb_rows, nb_columns:-1] = numpy.eye(nb_rows)
+    tableau[:nb_rows, -1] = 1.
+    tableau[-1, :nb_columns] = -1.
+    basis = list(range(nb_columns, nb_columns + nb_rows))
+    while True:
+        entering = numpy.flatnonzero(tableau[-1, :-1] < -SIMPLEX_TOLERANCE)
+        if not entering.size:
+            break
+        column = entering[0]
+        rows = numpy.flatnonzero(tableau[:nb_rows, column] > SIMPLEX_TOLERANCE)
+        ratios = tableau[rows, -1] / tableau[rows, column]
+        ties = rows[ratios <= ratios.min() + SIMPLEX_TOLERANCE]
+        row = min(ties, key=basis.__getitem__)
+        tableau[row] /= tableau[row, column]
+        pivot_column = tableau[:, column].copy()
+        pivot_column[row] = 0.
+        tableau -= numpy.outer(pivot_column, tableau[row])
+        basis[row] = column
+
+    total = tableau[-1, -1]
+    strategy = tableau[-1, nb_columns:-1] / total
+    return float(1. / total - shift), strategy.tolist()
+
+
+class EndgameAborted(Exception):
+    pass
+
+
+class EndgameSolver:
+    """Exact simultaneous-move search of the last days.
+
+    Every state is a matrix game between our actions and the opponent's, its entries the values of the next states.
+    A seed cannot score any more from ENDGAME_DAY on and a tree grown on the last day gives no sun, so SEED and then
+    GROW are left out. Values are memoized by game state, only once exact, so they stay valid across turns.
+    """
+
+    def __init__(self, board, values, time_budget, max_nodes=MAX_ENDGAME_NODES):
+        self.board = board
+        self.values = values
+        self.time_budget = time_budget
+        self.max_nodes = max_nodes
+        self.nb_nodes = 0
+
+    def solve(self, game_state):
+        """Return the value of game_state, our actions and their optimal probabilities."""
+        player_actions, opponent_actions = (sorted(self.get_actions(game_state, actions))
+                                            for actions in game_state.get_possible_actions(self.board))
+        matrix = [[self.get_value(game_state.get_next_state(player_action, opponent_action, self.board))
+                   for opponent_action in opponent_actions] for player_action in player_actions]
+        value, strategy = solve_matrix_game(matrix)
+        return value, player_actions, strategy
+
+    def get_value(self, game_state):
+        if game_state.day >= 24:
+            return game_state.get_score(self.board)
+        value = self.values.get(game_state)
+        if value is None:
+            self.nb_nodes += 1
+            if self.nb_nodes > self.max_nodes or self.time_budget.is_over():
+                raise EndgameAborted
+            value = self.solve(game_state)[0]
+            self.values[game_state] = value
+        return value
+
+    @staticmethod
+    def get_actions(game_state, actions):
+        pruned_types = (ActionType.SEED, ActionType.GROW) if game_state.day >= 23 else (ActionType.SEED,)
+        return [action for action in actions if action & 3 not in pruned_types]
 
 
 @dataclass
 class Simulation:
     board: Board
 
-    nodes: dict = field(default_factory=dict)
+    nodes: TranspositionTable = field(default_factory=TranspositionTable)
+    stop_requested: bool = False
+    ponder_thread: threading.Thread = None
+    nb_pondered: int = 0
+    endgame_values: dict = field(default_factory=dict)
+
+    def explore(self, game_state, time_budget, max_depth, player_action=None, telemetry=None, max_nodes=math.inf):
+        """Explore from game_state until the time budget or a stop request, with our action forced if player_action.
+
+        A SearchTelemetry counts and times the playouts. Once the table holds max_nodes, the exploration finishes the
+        pass of the sweep and goes on only if that made room.
+        """
+        # The root is created even in a full table, get_best_action needs it
+        root = self.nodes.get(game_state)
+        if root is None:
+            root = SimulationNode(game_state, self.board)
+            self.nodes.put(game_state, root)
+        forced_index = None
+        if player_action is not None and player_action in root.player.actions:
+            forced_index = root.player.actions.index(player_action)
 
-    def explore(self, game_state, stop_time, max_depth):
         nb_simulations = 0
-        while perf_counter_ns() < stop_time:
+        while not time_budget.is_over() and not self.stop_requested:
+            self.nodes.sweep()
+            if len(self.nodes) >= max_nodes:
+                while self.nodes.is_sweeping() and not self.stop_requested:
+                    self.nodes.sweep()
+                if len(self.nodes) >= max_nodes:
+                    break
+                continue
+            if telemetry is not None:
+                telemetry.lap('overhead')
             path = []
             current_game_state = game_state
             while current_game_state.day < 24 and current_game_state.day < game_state.day + max_depth:
-                if perf_counter_ns() >= stop_time:
-                    break
-
-                if current_game_state not in self.nodes:
+                node = self.nodes.get(current_game_state)
+                if node is None:
+                    if self.nodes.is_full():
+                        break
                     node = SimulationNode(current_game_state, self.board)
-                    self.nodes[current_game_state] = node
-                else:
-                    node = self.nodes[current_game_state]
-
-                player_action, opponent_action = node.get_actions(7.45)
-                path.append((node, player_action, opponent_action))
-                current_game_state = current_game_state.get_next_state(player_action, opponent_action, self.board)
+                    self.nodes.put(current_game_state, node)
+                    if telemetry is not None:
+                        telemetry.nb_nodes_created += 1
+                        telemetry.lap('expansion')
+
+                player_index, opponent_index = node.get_actions(EXPLORATION_FACTOR, None if path else forced_index)
+                path.append((node, player_index, opponent_index))
+                if telemetry is not None:
+                    telemetry.lap('selection')
+                current_game_state = current_game_state.get_next_state(
+                    node.player.actions[player_index], node.opponent.actions[opponent_index], self.board)
+                if telemetry is not None:
+                    telemetry.lap('transition')
 
             result = current_game_state.get_score(self.board)
-            for node, player_action, opponent_action in path:
-                node.update(player_action, opponent_action, result)
+            if telemetry is not None:
+                telemetry.lap('evaluation')
+            for node, player_index, opponent_index in path:
+                node.update(player_index, opponent_index, result)
             nb_simulations += 1
+            if telemetry is not None:
+                telemetry.lap('backpropagation')
+                telemetry.add_playout(len(path))
 
         return nb_simulations
 
     def get_best_action(self, game_state):
-        node = self.nodes[game_state]
-        # print(f"Total visits: {node.total_visits}", file=sys.stderr)
-        # print("Player actions:", file=sys.stderr)
-        # print(f"{node.player_action_to_explore}", file=sys.stderr)
-        # print('\n'.join(f"{action} : {(w, n, w/n)}" for action, (w, n) in node.player_explored_actions.items()), file=sys.stderr)
-        # print("Opponent actions:", file=sys.stderr)
-        # print(f"{node.opponent_action_to_explore}", file=sys.stderr)
-        # print('\n'.join(f"{action} : {(w, n, w / n)}" for action, (w, n) in node.opponent_explored_actions.items()), file=sys.stderr)
-        return node.get_best_action()
-
-    def clear(self, day):
-        self.nodes = {game_state: node for game_state, node in self.nodes.items() if game_state.day >= day}
+        return self.nodes.get(game_state).get_best_action()
+
+    def get_root_record(self, game_state, nb_actions=5):
+        """Visits of the root and the most visited actions of both players, for the telemetry."""
+        node = self.nodes.get(game_state)
+        if node is None:
+            return {}
+        return {'root_visits': node.total_visits, 'tried_actions': (node.player.nb_tried, node.opponent.nb_tried),
+                'player_actions': node.player.get_most_visited(nb_actions),
+                'opponent_actions': node.opponent.get_most_visited(nb_actions)}
+
+    def solve_endgame(self, game_state, time_budget):
+        """Our action from an exact solve of the end of the game, None if it exceeds its node or time budget."""
+        solver = EndgameSolver(self.board, self.endgame_values, time_budget)
+        try:
+            value, actions, strategy = solver.solve(game_state)
+        except EndgameAborted:
+            print(f'Endgame aborted after {solver.nb_nodes} states.', file=sys.stderr)
+            return None
+        print(f'Endgame solved over {solver.nb_nodes} states, value {value:.2f}.', file=sys.stderr)
+        return random.choices(actions, strategy)[0]
+
+    def reroot(self, game_state):
+        """Find the node of the new turn by its hash, it becomes the root of the next explore."""
+        self.nodes.start_sweep(game_state)
+        node = self.nodes.get(game_state)
+        visits = node.total_visits if node else 0
+        print(f'Reusing {visits} visits.', file=sys.stderr)
+        return node
+
+    def start_pondering(self, game_state, player_action, max_depth):
+        """Explore the replies to our action in a thread while the main one waits for the next turn.
+
+        The main thread releases the GIL while blocked on stdin. Call stop_pondering before touching the nodes.
+        Pondering is capped to the free space of the table, then it stops unless the sweep makes room.
+        """
+        def ponder():
+            self.nb_pondered = self.explore(game_state, TimeBudget(), max_depth, player_action,
+                                            max_nodes=self.nodes.capacity)
+
+        self.stop_requested = False
+        self.ponder_thread = threading.Thread(target=ponder, daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        if self.ponder_thread is None:
+            return 0
+        self.stop_requested = True
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.stop_requested = False
+        return self.nb_pondered
+
+
+def get_opening_key(board, game_state):
+    """Key of game_state in the opening book, and the index of the symmetry that maps it to its canonical form.
+
+    The canonical form is the smallest encoding of the cells and trees over the 12 symmetries of the hexagon, so that
+    a book entry covers every rotation and mirror of its position. The sun does not share these symmetries: it starts
+    from the same direction on every board, and a rotated position sees its shadows from another side. The book only
+    holds the first days, when the few small trees are too far apart for shadows to matter much.
+    Keys are CRC32 of the encoding to keep the book small, a colliding key is caught by the legality of its action.
+    """
+    if not isinstance(game_state, BitboardGameState):
+        game_state = BitboardGameState.from_game_state(game_state)
+    codes = []
+    for cell in board.cells:
+        bit = 1 << cell.index
+        code = 0
+        for offset, mask in enumerate(game_state.trees):
+            if mask & bit:
+                code = 1 + offset + (8 if game_state.dormant & bit else 0)
+        codes.append(17 * cell.richness + code)
+
+    encodings = []
+    for symmetry, permutation in enumerate(board.symmetries):
+        canonical_codes = [0] * len(codes)
+        for index, code in enumerate(codes):
+            canonical_codes[permutation[index]] = code
+        encodings.append((bytes(canonical_codes), symmetry))
+    encoding, symmetry = min(encodings)
+
+    scalars = (game_state.day, game_state.nutrients, *game_state.suns, *game_state.scores, *game_state.waiting)
+    return zlib.crc32(encoding + ' '.join(map(str, scalars)).encode()), symmetry
+
+
+def get_book_action(board, game_state, possible_actions):
+    """Our action from the opening book, None if game_state is not in it."""
+    key, symmetry = get_opening_key(board, game_state)
+    action = OPENING_BOOK.get(key)
+    if action is None:
+        return None
+    inverse = [0] * NB_CELLS
+    for index, image in enumerate(board.symmetries[symmetry]):
+        inverse[image] = index
+    action = transform_action(action, inverse)
+    return action if action in possible_actions else None
+
+
+def collect_garbage():
+    """Collect the reference cycles among the objects allocated since the last call, then freeze these objects.
+
+    Frozen objects are left out of later collections, so a call only scans one turn of allocations, a few ms. Return
+    the number of unreachable objects found.
+    """
+    nb_unreachable = gc.collect()
+    gc.freeze()
+    return nb_unreachable
+
+
+def set_parameters(parameters):
+    """Override tuned parameters by name, the tuner passes them as JSON on the command line of the bot."""
+    for name, value in parameters.items():
+        if name not in globals():
+            raise NameError(f'Unknown parameter {name}')
+        globals()[name] = value
 
 
 def main():
+    if len(sys.argv) > 1:
+        set_parameters(json.loads(sys.argv[1]))
+
+    # numpy is imported where it is used, so that the referee does not load it, but before the first turn starts
+    import numpy
+    # Reference counting frees the nodes. Without automatic collections, a search never pauses to scan the table: each
+    # turn collects what the previous one allocated, then freezes it out of the next collections, see collect_garbage.
+    # Only the bot does so, the tools that import this module keep their collector.
+    gc.disable()
+    gc.freeze()
+
     # Initialize board
     board = Board.get_board(3)
     number_of_cells = int(input())
@@ -465,12 +1315,27 @@ def main():
     board.update_cells_at_dist()
 
     simulation = Simulation(board)
+    # Hand the GIL back quickly to the main thread once the input of the next turn arrives
+    sys.setswitchinterval(1E-3)
+
+    time_budget = TimeBudget()
+    # The cost of an endgame state has nothing to do with the cost of a playout, each has its own statistics
+    endgame_time_budget = TimeBudget()
 
     first_turn = True
-    last_day = 0
-    timeout_margin = 1E6
+    in_book = True  # Until the first position missing from the book
     while True:
+        # The time starts with the first line. Pondering stops there, before the rest of the turn is parsed, and the
+        # join counts in the time of the turn.
         day = int(input())
+        start_time = perf_counter_ns()
+        nb_pondered = simulation.stop_pondering()
+        if nb_pondered:
+            print(f'Pondered {nb_pondered} simulations.', file=sys.stderr)
+        # In the time of the turn, the budget of the search shrinks by its cost
+        nb_unreachable = collect_garbage()
+        if nb_unreachable:
+            print(f'Collected {nb_unreachable} unreachable objects.', file=sys.stderr)
         nutrients = int(input())
         player = Player.from_string(input(), True)
         opponent = Player.from_string(input(), False)
@@ -479,31 +1344,57 @@ def main():
         trees = frozenset(Tree.from_string(input()) for _ in range(number_of_trees))
 
         game_state = GameState(day, nutrients, trees, player, opponent)
+        if USE_BITBOARD:
+            game_state = BitboardGameState.from_game_state(game_state)
 
         number_of_possible_actions = int(input())
-        possible_actions = frozenset(Action.from_string(input()) for _ in range(number_of_possible_actions))
+        possible_actions = frozenset(action_from_string(input()) for _ in range(number_of_possible_actions))
         # print(game_state.get_possible_actions(board), file=sys.stderr)
         # print(possible_actions, file=sys.stderr)
         # assert possible_actions == game_state.get_possible_actions(board)[player]
 
-        allowed_time = (1000E6 if first_turn else 100E6)
-        max_depth = 6 if first_turn else 3
-        start_time = perf_counter_ns()
-        nb_simulations = simulation.explore(game_state, start_time + allowed_time - timeout_margin, max_depth)
-
-        best_action = simulation.get_best_action(game_state)
-        print(best_action, flush=True)
+        allowed_time = 1000E6 if first_turn else 100E6 - HANDOFF_TIME
+        max_depth = FIRST_TURN_MAX_DEPTH if first_turn else MAX_DEPTH
+        if not first_turn:
+            simulation.reroot(game_state)
+        best_action, nb_simulations = None, 0
+        telemetry = SearchTelemetry(day) if TELEMETRY else None
+        if in_book:
+            best_action = get_book_action(board, game_state, possible_actions)
+            in_book = best_action is not None
+            source = 'book'
+        if best_action is None and day >= ENDGAME_DAY:
+            endgame_time_budget.start((allowed_time - RESPONSE_TIME) * ENDGAME_TIME_SHARE, start_time)
+            best_action = simulation.solve_endgame(game_state, endgame_time_budget)
+            source = 'endgame'
+        if best_action is None:
+            time_budget.start(allowed_time - RESPONSE_TIME, start_time)
+            nb_simulations = simulation.explore(game_state, time_budget, max_depth, telemetry=telemetry)
+            best_action = simulation.get_best_action(game_state)
+            source = 'search'
+        print(action_to_string(best_action), flush=True)
 
         elapsed_time = perf_counter_ns() - start_time
         print(f'Done {nb_simulations} simulations in {elapsed_time / 1E6:.3f} ms.', file=sys.stderr)
-        timeout_margin = max(timeout_margin*0.7, (elapsed_time - allowed_time) * (nb_simulations + 2) / nb_simulations)
-        print(f"Timeout margin = {timeout_margin/ 1E6:.3f} ms", file=sys.stderr)
+        if in_book:
+            print('Played from the opening book.', file=sys.stderr)
+        else:
+            time_budget.log()
+        if telemetry is not None:
+            telemetry.write(TELEMETRY, action=action_to_string(best_action), source=source,
+                            turn_time_ms=round(elapsed_time / 1E6, 3), pondered=nb_pondered,
+                            nodes=len(simulation.nodes), **simulation.get_root_record(game_state))
+
+        max_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f'Nodes: {len(simulation.nodes)}, max memory: {max_memory:.1f} MB', file=sys.stderr)
+        simulation.start_pondering(game_state, best_action, max_depth)
 
         first_turn = False
-        if day > last_day:
-            last_day = day
-            timeout_margin *= 2
-            # simulation.clear(day)
+
+
+# BEGIN OPENING BOOK, rewritten by spring_challenge_2021_book.py
+OPENING_BOOK = {}
+# END OPENING BOOK
 
 
 if __name__ == "__main__":
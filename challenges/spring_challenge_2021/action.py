@@ -1,33 +1,40 @@
-import random
-from dataclasses import dataclass
-from enum import Enum
-
-
-class ActionType(Enum):
-    GROW = "GROW"
-    SEED = "SEED"
-    COMPLETE = "COMPLETE"
-    WAIT = "WAIT"
-
-
-@dataclass(frozen=True)
-class Action:
-    type: ActionType
-    tree_index: int = -1
-    seed_index: int = -1
-
-    def __str__(self):
-        if self.type is ActionType.WAIT:
-            return 'WAIT Zzz'
-        elif self.type is ActionType.SEED:
-            return f'SEED {self.tree_index} {self.seed_index}'
-        else:
-            return f'{self.type.name} {self.tree_index}'
-
-    @staticmethod
-    def from_string(string):
-        action, *args = string.split()
-        return Action(ActionType(action), *(map(int, args)))
-
-    def __gt__(self, other):
-        return bool(random.getrandbits(1))
+from enum import IntEnum
+
+from board import NB_CELLS
+
+
+class ActionType(IntEnum):
+    WAIT = 0
+    COMPLETE = 1
+    SEED = 2
+    GROW = 3
+
+
+# Actions are small ints: type | target << 2 | origin << 8, the encoding of spring_challenge_2021.py.
+# The target is the cell of the tree that grows or completes, or the seeded cell. The origin is the seeding tree.
+Action = int
+
+
+def get_action(action_type: ActionType, target: int = 0, origin: int = 0) -> Action:
+    return action_type | target << 2 | origin << 8
+
+
+WAIT = get_action(ActionType.WAIT)
+
+# Strings are only needed to read and write actions
+ACTION_TO_STRING = {WAIT: 'WAIT Zzz'}
+for _target in range(NB_CELLS):
+    ACTION_TO_STRING[get_action(ActionType.GROW, _target)] = f'GROW {_target}'
+    ACTION_TO_STRING[get_action(ActionType.COMPLETE, _target)] = f'COMPLETE {_target}'
+    for _origin in range(NB_CELLS):
+        ACTION_TO_STRING[get_action(ActionType.SEED, _target, _origin)] = f'SEED {_origin} {_target}'
+STRING_TO_ACTION = {string: action for action, string in ACTION_TO_STRING.items()}
+STRING_TO_ACTION['WAIT'] = WAIT
+
+
+def action_to_string(action: Action) -> str:
+    return ACTION_TO_STRING[action]
+
+
+def action_from_string(string: str) -> Action:
+    return STRING_TO_ACTION[string.strip()]
@@ -20,6 +20,8 @@ class CubeCoord:
 
 DIRECTIONS = (CubeCoord(+1, -1, 0), CubeCoord(+1, 0, -1), CubeCoord(0, +1, -1),
               CubeCoord(-1, +1, 0), CubeCoord(-1, 0, +1), CubeCoord(0, -1, +1))
+MAX_TREE_SIZE = 3
+NB_CELLS = 37  # Board of size 3
 
 
 @dataclass(frozen=True)
@@ -43,6 +45,8 @@ class Board:
         self.index_to_coordinates = {}
         self.cells = []
         self.cells_at_dist = {}
+        self.seed_origins = {}
+        self.shadow_cells = []
 
         index = 0
         coord = CubeCoord(0, 0, 0)
@@ -67,8 +71,10 @@ class Board:
             coord += DIRECTIONS[0]
             richness -= 1
         self.update_cells_at_dist()
+        self.update_shadows()
 
     def update_cells_at_dist(self):
+        # cells_at_dist[(origin, size)] are the usable cells a tree of that size on origin can seed, up to size away
         self.cells_at_dist = {(origin, dist): set() for origin in self.index_to_coordinates for dist in range(4)}
         for target in self.cells:
             if target.richness > 0:
@@ -76,5 +82,24 @@ class Board:
                 for origin in self.cells:
                     origin_coord = self.index_to_coordinates[origin.index]
                     dist = origin_coord.distance(target_coord)
-                    if dist <= 3:
-                        self.cells_at_dist[(origin.index, dist)].add(target.index)
+                    if dist > 0:
+                        for size in range(dist, 4):
+                            self.cells_at_dist[(origin.index, size)].add(target.index)
+        # seed_origins[(target, size)] are the cells from which a tree of that size can seed the target
+        self.seed_origins = {key: [] for key in self.cells_at_dist}
+        for (origin, dist), targets in self.cells_at_dist.items():
+            for target in targets:
+                self.seed_origins[(target, dist)].append(origin)
+
+    def update_shadows(self):
+        # shadow_cells[direction][size][index] are the cells shadowed by a tree of that size on that index
+        nb_cells = len(self.index_to_coordinates)
+        self.shadow_cells = [[[()] * nb_cells for _ in range(MAX_TREE_SIZE + 1)] for _ in DIRECTIONS]
+        for direction_index, direction in enumerate(DIRECTIONS):
+            for index, coord in self.index_to_coordinates.items():
+                cells = []
+                for size in range(1, MAX_TREE_SIZE + 1):
+                    coord += direction
+                    if coord in self.coordinates_to_index:
+                        cells.append(self.coordinates_to_index[coord])
+                    self.shadow_cells[direction_index][size][index] = tuple(cells)
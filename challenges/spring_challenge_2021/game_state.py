@@ -2,8 +2,8 @@
 from collections import Counter
 from dataclasses import dataclass
 
-from action import Action, ActionType
-from board import Board, DIRECTIONS
+from action import Action, ActionType, WAIT, get_action
+from board import Board, MAX_TREE_SIZE
 
 
 @dataclass
@@ -42,7 +42,6 @@ class Tree:
 
 
 GROW_COST = [1, 3, 7]
-MAX_TREE_SIZE = 3
 MAX_DAY = 24
 
 
@@ -56,12 +55,15 @@ class GameState:
         self.tree_count = (Counter(), Counter())
         for tree in trees:
             self.tree_count[tree.player][tree.size] += 1
+        # Undo log: (revert, target, key, old value) records, and the history length before each update
+        self.history = []
+        self.history_marks = []
 
     def get_copy(self):
         return GameState(
             self.day,
             self.nutrients,
-            tuple(self.index_to_tree.values()),
+            tuple(tree.get_copy() for tree in self.index_to_tree.values()),
             tuple(player.get_copy() for player in self.players)
         )
 
@@ -74,7 +76,7 @@ class GameState:
                      ))
 
     def get_possible_actions(self, board: Board) -> tuple[list[Action], ...]:
-        possible_actions = tuple([Action(ActionType.WAIT)] for _ in self.players)
+        possible_actions = tuple([WAIT] for _ in self.players)
 
         occupied_cells = self.index_to_tree.keys()
 
@@ -85,75 +87,116 @@ class GameState:
                 continue
             if tree.size < MAX_TREE_SIZE:
                 if player.sun >= GROW_COST[tree.size] + self.tree_count[tree.player][tree.size + 1]:
-                    actions.append(Action(ActionType.GROW, tree.cell_index))
+                    actions.append(get_action(ActionType.GROW, tree.cell_index))
             elif tree.size == MAX_TREE_SIZE:
                 if player.sun >= 4:
-                    actions.append(Action(ActionType.COMPLETE, tree.cell_index))
+                    actions.append(get_action(ActionType.COMPLETE, tree.cell_index))
             if player.sun >= self.tree_count[tree.player][0]:
                 for seed_index in board.cells_at_dist[(tree.cell_index, tree.size)] - occupied_cells:
-                    actions.append(Action(ActionType.SEED, tree.cell_index, seed_index))
+                    actions.append(get_action(ActionType.SEED, seed_index, tree.cell_index))
 
         return possible_actions
 
     def update(self, actions: tuple[Action, ...], board: Board):
-        if all(action.type == ActionType.SEED and action.seed_index == actions[0].seed_index for action in actions):
+        """Apply the actions of both players, undo() reverts them."""
+        self.history_marks.append(len(self.history))
+
+        if all(action & 3 == ActionType.SEED and action >> 2 & 63 == actions[0] >> 2 & 63 for action in actions):
             # Both seed at the same place. Put origin trees to dormant.
             for action in actions:
-                self.index_to_tree[action.tree_index].is_dormant = True
+                self._set(self.index_to_tree[action >> 8], 'is_dormant', True)
+            return
 
         nb_completed = 0
-        for player, action, is_mine in zip(self.players, actions, (True, False)):
-            if action.type == ActionType.WAIT:
-                player.is_waiting = True
+        for player_index, (player, action) in enumerate(zip(self.players, actions)):
+            action_type = action & 3
+            if action_type == ActionType.WAIT:
+                self._set(player, 'is_waiting', True)
                 continue
 
-            tree = self.index_to_tree[action.tree_index]
-            tree_count = self.tree_count[is_mine]
-            if action.type == ActionType.GROW:
-                player.sun -= GROW_COST[tree.size] + tree_count[tree.size + 1]
-                tree_count[tree.size] -= 1
-                tree.size += 1
-                tree_count[tree.size] += 1
-                tree.is_dormant = True
-            elif action.type == ActionType.SEED:
-                player.sun -= tree_count[0]
-                tree.is_dormant = True
-                seed = Tree(action.seed_index, 0, is_mine, True)
-                tree_count[0] += 1
-                self.index_to_tree[seed.cell_index] = seed
-            elif action.type == ActionType.COMPLETE:
-                player.sun -= 4
-                player.score += self.nutrients + board.cells[action.tree_index].richness
-                tree_count[tree.size] -= 1
-                del self.index_to_tree[tree.cell_index]
+            target = action >> 2 & 63
+            tree = self.index_to_tree[action >> 8 if action_type == ActionType.SEED else target]
+            tree_count = self.tree_count[player_index]
+            if action_type == ActionType.GROW:
+                self._set(player, 'sun', player.sun - GROW_COST[tree.size] - tree_count[tree.size + 1])
+                self._add_count(tree_count, tree.size, -1)
+                self._set(tree, 'size', tree.size + 1)
+                self._add_count(tree_count, tree.size, 1)
+                self._set(tree, 'is_dormant', True)
+            elif action_type == ActionType.SEED:
+                self._set(player, 'sun', player.sun - tree_count[0])
+                self._set(tree, 'is_dormant', True)
+                self._add_count(tree_count, 0, 1)
+                self._set_item(self.index_to_tree, target, Tree(target, 0, player_index, True))
+            elif action_type == ActionType.COMPLETE:
+                self._set(player, 'sun', player.sun - 4)
+                self._set(player, 'score', player.score + self.nutrients + board.cells[target].richness)
+                self._add_count(tree_count, tree.size, -1)
+                self._delete_item(self.index_to_tree, tree.cell_index)
                 nb_completed += 1
 
-        self.nutrients -= nb_completed
+        if nb_completed:
+            self._set(self, 'nutrients', self.nutrients - nb_completed)
 
         # New day
         if all(player.is_waiting for player in self.players):
-            self.day += 1
+            self._set(self, 'day', self.day + 1)
 
             if self.day < 24:
                 # Calculate shadows
-                shadows = {index: 0 for index in board.index_to_coordinates}
-                direction = DIRECTIONS[self.day % 6]
+                shadows = [0] * len(board.cells)
+                shadow_cells = board.shadow_cells[self.day % 6]
                 for tree in self.index_to_tree.values():
-                    coord = board.index_to_coordinates[tree.cell_index]
-                    for distance in range(1, tree.size + 1):
-                        coord += direction
-                        if coord not in board.coordinates_to_index:
-                            break
-                        index = board.coordinates_to_index[coord]
+                    for index in shadow_cells[tree.size][tree.cell_index]:
                         shadows[index] = max(shadows[index], tree.size)
 
                 # Gain sun and reset trees
+                dormant_trees = []
+                suns = [player.sun for player in self.players]
                 for tree in self.index_to_tree.values():
-                    tree.is_dormant = False
+                    if tree.is_dormant:
+                        dormant_trees.append(tree)
+                        tree.is_dormant = False
                     if tree.size > shadows[tree.cell_index]:
-                        self.players[tree.player].sun += tree.size
+                        suns[tree.player] += tree.size
+                self.history.append((_set_dormant, dormant_trees, None, None))
 
                 # Wake up players
-                for player in self.players:
-                    player.is_waiting = False
+                for player, sun in zip(self.players, suns):
+                    self._set(player, 'sun', sun)
+                    self._set(player, 'is_waiting', False)
+
+    def undo(self):
+        """Revert the last update."""
+        mark = self.history_marks.pop()
+        history = self.history
+        while len(history) > mark:
+            revert, target, key, value = history.pop()
+            revert(target, key, value)
+
+    def _set(self, target, attribute, value):
+        self.history.append((setattr, target, attribute, getattr(target, attribute)))
+        setattr(target, attribute, value)
+
+    def _add_count(self, tree_count, size, count):
+        self.history.append((dict.__setitem__, tree_count, size, tree_count[size]))
+        tree_count[size] += count
+
+    def _set_item(self, mapping, key, value):
+        if key in mapping:
+            self.history.append((dict.__setitem__, mapping, key, mapping[key]))
+        else:
+            self.history.append((_delete_item, mapping, key, None))
+        mapping[key] = value
+
+    def _delete_item(self, mapping, key):
+        self.history.append((dict.__setitem__, mapping, key, mapping.pop(key)))
+
+
+def _delete_item(mapping, key, _):
+    del mapping[key]
+
 
+def _set_dormant(trees, *_):
+    for tree in trees:
+        tree.is_dormant = True
@@ -0,0 +1,110 @@
+import random
+
+from action import Action, ActionType, WAIT, get_action
+from board import Board, MAX_TREE_SIZE
+from game_state import GameState, GROW_COST
+
+
+class MoveGenerator:
+    """Legal actions of both players, kept up to date from the deltas of each update of the game state.
+
+    Only the awake trees and the number of free cells each of them can seed are stored. Sun costs are checked
+    when sampling, so spending sun needs no update. A new day wakes every tree up and rebuilds everything.
+    """
+
+    def __init__(self, game_state: GameState, board: Board):
+        self.game_state = game_state
+        self.board = board
+        self.rebuild()
+
+    def rebuild(self):
+        game_state = self.game_state
+        self.day = game_state.day
+        self.awake_trees = tuple(tuple([] for _ in range(MAX_TREE_SIZE + 1)) for _ in game_state.players)
+        self.awake_cells = {}
+        self.free_targets = {}
+        self.nb_seeds = [0 for _ in game_state.players]
+
+        occupied_cells = set(game_state.index_to_tree)
+        for tree in game_state.index_to_tree.values():
+            if tree.is_dormant:
+                continue
+            self.awake_trees[tree.player][tree.size].append(tree.cell_index)
+            self.awake_cells[tree.cell_index] = (tree.player, tree.size)
+            free_targets = len(self.board.cells_at_dist[(tree.cell_index, tree.size)] - occupied_cells)
+            self.free_targets[tree.cell_index] = free_targets
+            self.nb_seeds[tree.player] += free_targets
+
+    def update(self, actions: tuple[Action, ...]):
+        """Follow the game state once it applied the actions."""
+        if self.game_state.day != self.day:
+            self.rebuild()
+            return
+
+        if all(action & 3 == ActionType.SEED and action >> 2 & 63 == actions[0] >> 2 & 63 for action in actions):
+            for action in actions:
+                self._fall_asleep(action >> 8)
+            return
+
+        for action in actions:
+            action_type = action & 3
+            if action_type == ActionType.GROW:
+                self._fall_asleep(action >> 2 & 63)
+            elif action_type == ActionType.SEED:
+                self._fall_asleep(action >> 8)
+                self._update_free_targets(action >> 2 & 63, -1)
+            elif action_type == ActionType.COMPLETE:
+                self._fall_asleep(action >> 2 & 63)
+                self._update_free_targets(action >> 2 & 63, 1)
+
+    def get_random_action(self, player_index: int) -> Action:
+        """Uniformly drawn legal action, as random.choice(get_possible_actions()[player_index])."""
+        game_state = self.game_state
+        player = game_state.players[player_index]
+        if player.is_waiting:
+            return WAIT
+
+        sun = player.sun
+        tree_count = game_state.tree_count[player_index]
+        awake_trees = self.awake_trees[player_index]
+        nb_grows = [0] * (MAX_TREE_SIZE + 1)
+        for size in range(MAX_TREE_SIZE + 1):
+            cost = GROW_COST[size] + tree_count[size + 1] if size < MAX_TREE_SIZE else 4
+            if sun >= cost:
+                nb_grows[size] = len(awake_trees[size])
+        nb_seeds = self.nb_seeds[player_index] if sun >= tree_count[0] else 0
+
+        choice = random.randrange(1 + sum(nb_grows) + nb_seeds)
+        if choice == 0:
+            return WAIT
+        choice -= 1
+
+        for size, nb_grow in enumerate(nb_grows):
+            if choice < nb_grow:
+                action_type = ActionType.GROW if size < MAX_TREE_SIZE else ActionType.COMPLETE
+                return get_action(action_type, awake_trees[size][choice])
+            choice -= nb_grow
+
+        for size, cells in enumerate(awake_trees):
+            for cell_index in cells:
+                free_targets = self.free_targets[cell_index]
+                if choice < free_targets:
+                    for seed_index in self.board.cells_at_dist[(cell_index, size)]:
+                        if seed_index not in game_state.index_to_tree:
+                            if choice == 0:
+                                return get_action(ActionType.SEED, seed_index, cell_index)
+                            choice -= 1
+                choice -= free_targets
+
+    def _fall_asleep(self, cell_index):
+        player_index, size = self.awake_cells.pop(cell_index)
+        self.awake_trees[player_index][size].remove(cell_index)
+        self.nb_seeds[player_index] -= self.free_targets.pop(cell_index)
+
+    def _update_free_targets(self, cell_index, delta):
+        for size in range(1, MAX_TREE_SIZE + 1):
+            for origin in self.board.seed_origins[(cell_index, size)]:
+                tree = self.awake_cells.get(origin)
+                if tree is not None and tree[1] == size:
+                    self.free_targets[origin] += delta
+                    self.nb_seeds[tree[0]] += delta
@@ -0,0 +1,68 @@
+import math
+import sys
+from statistics import NormalDist
+from time import perf_counter_ns
+
+
+class TimeBudget:
+    """Tell a search loop when to stop so that it answers before its deadline.
+
+    The cost of a batch of check_period iterations is learned online as an exponentially weighted mean and variance,
+    kept from one turn to the next. The loop stops once the next batch would overrun the deadline with a probability
+    above 1 - quantile. The clock is only read every check_period calls to is_over(), the cheap over attribute tells
+    the outer loops of a nested search that the inner one stopped.
+    """
+
+    def __init__(self, quantile=0.99, check_period=1, smoothing=0.1):
+        self.z_score = NormalDist().inv_cdf(quantile)
+        self.check_period = check_period
+        self.smoothing = smoothing
+        self.mean = None
+        self.variance = 0.
+        self.start()
+
+    def start(self, duration=math.inf, start_time=None):
+        """Start a turn of duration ns, from start_time if the clock started earlier than now."""
+        self.start_time = perf_counter_ns() if start_time is None else start_time
+        self.deadline = self.start_time + duration
+        self.last_time = self.start_time
+        self.countdown = 1  # The first call checks the clock
+        self.nb_checks = 0
+        self.over = False
+
+    def is_over(self):
+        """Call before each iteration. Return whether the loop must stop."""
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.check_period
+
+        now = perf_counter_ns()
+        if self.nb_checks:
+            self.add_sample(now - self.last_time)
+        self.nb_checks += 1
+        self.last_time = now
+        self.over = now + self.get_margin() > self.deadline
+        return self.over
+
+    def add_sample(self, cost):
+        if self.mean is None:
+            # A single sample says nothing of the spread, assume it is as large as the cost
+            self.mean, self.variance = cost, cost * cost
+            return
+        delta = cost - self.mean
+        self.mean += self.smoothing * delta
+        self.variance = (1 - self.smoothing) * (self.variance + self.smoothing * delta * delta)
+
+    def get_margin(self):
+        """Time to keep for the next batch of iterations."""
+        if self.mean is None:
+            return 0
+        return self.mean + self.z_score * math.sqrt(self.variance)
+
+    def log(self):
+        used = self.last_time - self.start_time
+        unused = self.deadline - self.last_time
+        cost = (self.mean or 0) / self.check_period
+        print(f'Used {used / 1E6:.1f} ms, {unused / 1E6:.1f} ms unused. '
+              f'Iteration cost {cost / 1E6:.3f} ms, margin {self.get_margin() / 1E6:.3f} ms.', file=sys.stderr)
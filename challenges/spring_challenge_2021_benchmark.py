@@ -0,0 +1,238 @@
+"""Throughput benchmark of the Spring Challenge 2021 engines.
+
+Times the hot functions of the immutable engine (spring_challenge_2021.py, with and without bitboards) and of the
+mutable one (spring_challenge_2021/) over a fixed corpus of mid-game states, then the playouts per second of a full
+explore. Timings are only comparable on the same quiet machine. Run it from this directory:
+    python spring_challenge_2021_benchmark.py           # compare with the saved results
+    python spring_challenge_2021_benchmark.py --save    # and save these ones
+    python spring_challenge_2021_benchmark.py --record  # regenerate the corpus, which changes every result
+"""
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+from time import perf_counter_ns
+
+import spring_challenge_2021 as immutable
+
+sys.path.insert(0, str(Path(__file__).parent / 'spring_challenge_2021'))
+import board as mutable_board
+import game_state as mutable_game_state
+import move_generator as mutable_move_generator
+import simulation as mutable_simulation
+import time_budget as mutable_time_budget
+
+CORPUS_PATH = Path(__file__).with_name('spring_challenge_2021_benchmark_corpus.jsonl')
+RESULTS_PATH = Path(__file__).with_name('spring_challenge_2021_benchmark_results.json')
+RECORDED_DAYS = (6, 9, 12, 15, 18)
+NB_RECORDED_GAMES = 8
+NB_ACTIONS_PER_STATE = 8
+NB_ROUNDS = 3
+NB_REPEATS = 3
+REPEAT_TIME = 50E6
+EXPLORE_TIME = 50E6
+REGRESSION_THRESHOLD = 0.1
+
+
+def record_corpus(path):
+    """Play random games on the referee's boards and keep a few of their states."""
+    from spring_challenge_2021_referee import get_initial_state, get_random_board
+
+    with open(path, 'w') as file:
+        for seed in range(NB_RECORDED_GAMES):
+            rng = random.Random(seed)
+            board = get_random_board(rng)
+            game_state = get_initial_state(board, rng)
+            recorded_days = set()
+            while game_state.day < max(RECORDED_DAYS) + 1:
+                if game_state.day in RECORDED_DAYS and game_state.day not in recorded_days:
+                    recorded_days.add(game_state.day)
+                    print(json.dumps(to_record(board, game_state)), file=file)
+                player_actions, opponent_actions = game_state.get_possible_actions(board)
+                game_state = game_state.get_next_state(rng.choice(sorted(player_actions)),
+                                                       rng.choice(sorted(opponent_actions)), board)
+
+
+def to_record(board, game_state):
+    return {
+        'richness': [cell.richness for cell in board.cells],
+        'day': game_state.day,
+        'nutrients': game_state.nutrients,
+        'player': [game_state.player.sun, game_state.player.score, game_state.player.is_waiting],
+        'opponent': [game_state.opponent.sun, game_state.opponent.score, game_state.opponent.is_waiting],
+        'trees': sorted([tree.cell_index, tree.size, tree.is_mine, tree.is_dormant] for tree in game_state.trees),
+    }
+
+
+class Sample:
+    """One corpus state in both engines, with random legal action pairs to apply to it."""
+
+    def __init__(self, record, rng):
+        self.record = record
+        self.board = immutable.Board.get_board(3)
+        self.board.cells = [immutable.Cell(index, richness) for index, richness in enumerate(record['richness'])]
+        self.board.update_cells_at_dist()
+        self.mutable_board = mutable_board.Board(3)
+        self.mutable_board.cells = [mutable_board.Cell(index, richness)
+                                    for index, richness in enumerate(record['richness'])]
+        self.mutable_board.update_cells_at_dist()
+
+        self.game_state = self.get_game_state()
+        self.bitboard_game_state = immutable.BitboardGameState.from_game_state(self.game_state)
+        player_actions, opponent_actions = self.game_state.get_possible_actions(self.board)
+        # Both engines encode actions the same way
+        self.actions = [(rng.choice(sorted(player_actions)), rng.choice(sorted(opponent_actions)))
+                        for _ in range(NB_ACTIONS_PER_STATE)]
+
+    def get_game_state(self):
+        record = self.record
+        trees = frozenset(immutable.Tree(*tree) for tree in record['trees'])
+        return immutable.GameState(record['day'], record['nutrients'], trees,
+                                   immutable.Player(True, *record['player']),
+                                   immutable.Player(False, *record['opponent']))
+
+    def get_mutable_game_state(self):
+        record = self.record
+        trees = tuple(mutable_game_state.Tree(cell_index, size, 0 if is_mine else 1, is_dormant)
+                      for cell_index, size, is_mine, is_dormant in record['trees'])
+        players = (mutable_game_state.Player(*record['player']), mutable_game_state.Player(*record['opponent']))
+        return mutable_game_state.GameState(record['day'], record['nutrients'], trees, players)
+
+
+def time_calls(samples, get_calls):
+    """Best ns per call over the repeats, get_calls gives the zero-argument calls of one sample.
+
+    Each repeat loops over the calls for at least REPEAT_TIME so that short functions are not lost in the noise.
+    """
+    calls = [call for sample in samples for call in get_calls(sample)]
+    best = None
+    for _ in range(NB_REPEATS):
+        nb_calls = 0
+        start_time = perf_counter_ns()
+        while nb_calls == 0 or perf_counter_ns() - start_time < REPEAT_TIME:
+            for call in calls:
+                call()
+            nb_calls += len(calls)
+        time_per_call = (perf_counter_ns() - start_time) / nb_calls
+        best = time_per_call if best is None else min(best, time_per_call)
+    return best
+
+
+def time_explore(samples, explore, time_budget):
+    """Playouts per second of explore, which takes a sample and a time budget and returns its number of playouts."""
+    nb_playouts, total_time = 0, 0
+    for sample in samples:
+        start_time = perf_counter_ns()
+        time_budget.start(EXPLORE_TIME, start_time)
+        nb_playouts += explore(sample, time_budget)
+        total_time += perf_counter_ns() - start_time
+    return nb_playouts / total_time * 1E9
+
+
+def get_immutable_calls(name, use_bitboard):
+    def get_calls(sample):
+        game_state = sample.bitboard_game_state if use_bitboard else sample.game_state
+        if name == 'get_possible_actions':
+            return [lambda: game_state.get_possible_actions(sample.board)]
+        if name == 'get_next_state':
+            return [lambda actions=actions: game_state.get_next_state(*actions, sample.board)
+                    for actions in sample.actions]
+        if name == 'get_score':
+            return [lambda: game_state.get_score(sample.board)]
+        raise ValueError(name)
+
+    return get_calls
+
+
+def get_mutable_calls(name):
+    def get_calls(sample):
+        game_state = sample.get_mutable_game_state()
+        board = sample.mutable_board
+        if name == 'get_possible_actions':
+            return [lambda: game_state.get_possible_actions(board)]
+        if name == 'update_undo':
+            def update_undo(actions):
+                game_state.update(actions, board)
+                game_state.undo()
+
+            return [lambda actions=actions: update_undo(actions) for actions in sample.actions]
+        if name == 'get_random_action':
+            move_generator = mutable_move_generator.MoveGenerator(game_state, board)
+            return [lambda: move_generator.get_random_action(0)]
+        raise ValueError(name)
+
+    return get_calls
+
+
+def explore_immutable(sample, time_budget, use_bitboard):
+    game_state = sample.bitboard_game_state if use_bitboard else sample.game_state
+    return immutable.Simulation(sample.board).explore(game_state, time_budget, 3)
+
+
+def explore_mutable(sample, time_budget):
+    return mutable_simulation.Simulation(sample.mutable_board).explore(sample.get_mutable_game_state(), time_budget)[1]
+
+
+def run_benchmarks(samples):
+    """Results by name: unit and best value."""
+    benchmarks = {}
+    for use_bitboard, engine in ((False, 'immutable'), (True, 'bitboard')):
+        for name in ('get_possible_actions', 'get_next_state', 'get_score'):
+            benchmarks[f'{engine}.{name}'] = ('ns/call', lambda get_calls=get_immutable_calls(name, use_bitboard):
+                                              time_calls(samples, get_calls))
+        benchmarks[f'{engine}.explore'] = ('playouts/s', lambda use_bitboard=use_bitboard: time_explore(
+            samples, lambda sample, time_budget: explore_immutable(sample, time_budget, use_bitboard),
+            immutable.TimeBudget()))
+    for name in ('get_possible_actions', 'update_undo', 'get_random_action'):
+        benchmarks[f'mutable.{name}'] = ('ns/call', lambda get_calls=get_mutable_calls(name):
+                                         time_calls(samples, get_calls))
+    benchmarks['mutable.explore'] = ('playouts/s', lambda: time_explore(samples, explore_mutable,
+                                                                        mutable_time_budget.TimeBudget()))
+
+    # Rounds over every benchmark rather than repeats of each, so that a slow spell of the machine only costs a round
+    results = {}
+    for _ in range(NB_ROUNDS):
+        for name, (unit, benchmark) in benchmarks.items():
+            value = benchmark()
+            if name in results:
+                value = min(value, results[name][1]) if unit == 'ns/call' else max(value, results[name][1])
+            results[name] = (unit, value)
+    return results
+
+
+def print_results(results, previous_results):
+    """A positive change is a faster engine."""
+    for name, (unit, value) in results.items():
+        line = f'{name:35} {value:12.0f} {unit:10}'
+        if name in previous_results:
+            previous_value = previous_results[name][1]
+            speedup = previous_value / value - 1 if unit == 'ns/call' else value / previous_value - 1
+            line += f'  {speedup:+7.1%}' + ('  REGRESSION' if speedup < -REGRESSION_THRESHOLD else '')
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--record', action='store_true', help='Regenerate the corpus of game states')
+    parser.add_argument('--save', action='store_true', help='Save the results to compare the next runs with')
+    parser.add_argument('--results', type=Path, default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    if args.record:
+        record_corpus(CORPUS_PATH)
+
+    rng = random.Random(0)
+    with open(CORPUS_PATH) as file:
+        samples = [Sample(json.loads(line), rng) for line in file]
+
+    previous_results = json.loads(args.results.read_text()) if args.results.exists() else {}
+    results = run_benchmarks(samples)
+    print_results(results, previous_results)
+
+    if args.save:
+        args.results.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
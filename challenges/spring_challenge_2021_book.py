@@ -0,0 +1,96 @@
+"""Offline opening book of the Spring Challenge 2021 bot.
+
+Runs long searches from the starting positions of the referee's random boards, in parallel, and follows the best
+actions of both players from each root while their nodes are visited enough. Our action in each of these positions
+goes to the book, keyed by get_opening_key so that one entry covers the 12 symmetric positions. The bot answers from
+the book until the first position missing from it. Run it from this directory:
+    python spring_challenge_2021_book.py --boards 200 --time 10          # print the size of the book
+    python spring_challenge_2021_book.py --boards 200 --time 10 --write  # and add it to the bot
+Each entry costs about 20 characters of the 100k the bot may weigh once merged.
+"""
+import argparse
+import ast
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import spring_challenge_2021 as bot
+from spring_challenge_2021_referee import get_initial_state, get_random_board
+
+BOT_PATH = Path(__file__).with_name('spring_challenge_2021.py')
+BOOK_BLOCK_PATTERN = re.compile(r'(# BEGIN OPENING BOOK[^\n]*\n)(.*?)(# END OPENING BOOK)', re.DOTALL)
+MIN_VISITS = 1000  # Below, a node is not searched better than during a game
+MAX_PLIES = 8
+ENTRIES_PER_LINE = 6
+
+
+def search_board(seed, search_time, max_plies=MAX_PLIES):
+    """Book entries of the board of the seed: key, our action in the canonical form and visits."""
+    rng = random.Random(seed)
+    board = get_random_board(rng)
+    game_state = get_initial_state(board, rng)
+    if bot.USE_BITBOARD:
+        game_state = bot.BitboardGameState.from_game_state(game_state)
+
+    simulation = bot.Simulation(board)
+    time_budget = bot.TimeBudget()
+    time_budget.start(search_time)
+    simulation.explore(game_state, time_budget, bot.FIRST_TURN_MAX_DEPTH)
+
+    entries = []
+    for _ in range(max_plies):
+        node = simulation.nodes.get(game_state)
+        if node is None or node.total_visits < MIN_VISITS:
+            break
+        player_action, opponent_action = node.get_best_action(), node.opponent.get_best_action()
+        key, symmetry = bot.get_opening_key(board, game_state)
+        entries.append((key, bot.transform_action(player_action, board.symmetries[symmetry]), node.total_visits))
+        game_state = game_state.get_next_state(player_action, opponent_action, board)
+    return entries
+
+
+def read_book(path):
+    block = BOOK_BLOCK_PATTERN.search(path.read_text()).group(2)
+    return ast.literal_eval(block.split('=', 1)[1].strip())
+
+
+def write_book(path, book):
+    items = [f'{key}: {action}' for key, action in sorted(book.items())]
+    lines = [', '.join(items[start:start + ENTRIES_PER_LINE]) for start in range(0, len(items), ENTRIES_PER_LINE)]
+    block = 'OPENING_BOOK = {\n' + ''.join(f'    {line},\n' for line in lines) + '}\n' if lines else 'OPENING_BOOK = {}\n'
+    source = path.read_text()
+    path.write_text(BOOK_BLOCK_PATTERN.sub(lambda match: match.group(1) + block + match.group(3), source, count=1))
+
+
+def build_book(seeds, search_time, nb_workers=None):
+    """Entries of the searched boards, the most visited one wins when positions of two boards are the same."""
+    book, visits = {}, {}
+    with ProcessPoolExecutor(nb_workers) as executor:
+        for entries in executor.map(search_board, seeds, [search_time] * len(seeds)):
+            for key, action, total_visits in entries:
+                if total_visits > visits.get(key, 0):
+                    book[key], visits[key] = action, total_visits
+    return book
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--boards', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first board, the referee plays from 0')
+    parser.add_argument('--time', type=float, default=10., help='Search time per board in seconds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--write', action='store_true', help='Add the new entries to the book of the bot')
+    args = parser.parse_args()
+
+    book = build_book(range(args.seed, args.seed + args.boards), args.time * 1E9, args.workers)
+    print(f'{len(book)} positions from {args.boards} boards.')
+    if args.write:
+        book = {**read_book(BOT_PATH), **book}
+        write_book(BOT_PATH, book)
+        print(f'The book of {BOT_PATH.name} holds {len(book)} positions.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Local referee and arena for Spring Challenge 2021.
+
+Plays bots against each other through the stdin/stdout protocol of the game, with the rules of GameState:
+    python spring_challenge_2021_referee.py "python spring_challenge_2021.py" "python other_bot.py" --games 40
+Each seed is played twice with the bots swapped. Both bots of a game run as subprocesses and think at the same time,
+so keep the number of workers at most half the number of cores or raise --time-factor, otherwise the bots steal time
+from each other and time out. Like on CodinGame, a bot is only forfeited once it goes past the time limit by more than
+the grace margin. A forfeited game is not scored, the report lists it with the bot at fault.
+"""
+import argparse
+import math
+import os
+import random
+import re
+import selectors
+import shlex
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from time import perf_counter_ns
+
+from spring_challenge_2021 import (Board, Cell, CubeCoord, DIRECTIONS, GameState, Player, Tree, WAIT,
+                                   action_to_string, action_from_string)
+
+FIRST_TURN_TIME = 1000E6
+TURN_TIME = 100E6
+STARTUP_TIME = 1000E6  # The first turn also covers the start of the interpreter and the imports
+GRACE_TIME = 25E6  # Tolerance over the time limits, not scaled by the time factor
+SIMULATIONS_PATTERN = re.compile(r'Done (\d+) simulations')
+
+
+@dataclass
+class GameResult:
+    seed: int
+    scores: tuple = (0, 0)
+    winner: int = None  # None on a draw or a forfeit
+    failures: tuple = ('', '')  # Why each bot forfeited the game, empty if it did not
+    latencies: tuple = field(default_factory=lambda: ([], []))  # ms per turn, first turn included
+    simulations: tuple = field(default_factory=lambda: ([], []))
+
+    def is_forfeit(self):
+        return any(self.failures)
+
+
+class Bot:
+    def __init__(self, command, log_file):
+        self.process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=log_file)
+        self.buffer = b''
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def send(self, lines):
+        self.process.stdin.write(('\n'.join(lines) + '\n').encode())
+        self.process.stdin.flush()
+
+    def read_line(self):
+        """Read what the bot wrote so far, return its next line once complete."""
+        data = os.read(self.fileno(), 4096)
+        if not data:
+            raise EOFError
+        self.buffer += data
+        if b'\n' not in self.buffer:
+            return None
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.decode()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+def receive_lines(bots, start_time, timeout):
+    """Wait for one line of each bot, in whatever order they answer.
+
+    Return the lines and latencies by bot index. A bot that timed out is missing, one that crashed has a None line.
+    """
+    lines, latencies = {}, {}
+    with selectors.DefaultSelector() as selector:
+        for index, bot in bots.items():
+            selector.register(bot, selectors.EVENT_READ, index)
+        while len(lines) < len(bots):
+            remaining = start_time + timeout - perf_counter_ns()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining / 1E9):
+                try:
+                    line = key.fileobj.read_line()
+                except EOFError:
+                    line = None
+                else:
+                    if line is None:
+                        continue
+                lines[key.data] = line
+                latencies[key.data] = (perf_counter_ns() - start_time) / 1E6
+                selector.unregister(key.fileobj)
+    return lines, latencies
+
+
+def get_random_board(rng):
+    """Richness by ring like the official referee, with a few symmetric holes."""
+    board = Board.get_board(3)
+    for index, coord in board.index_to_coordinates.items():
+        ring = coord.distance(CubeCoord(0, 0, 0))
+        board.cells[index] = Cell(index, (3, 3, 2, 1)[ring])
+    for index in rng.sample(range(1, len(board.cells)), rng.randint(0, 2)):
+        for hole in (index, get_opposite(board, index)):
+            board.cells[hole] = Cell(hole, 0)
+    board.update_cells_at_dist()
+    return board
+
+
+def get_opposite(board, index):
+    coord = board.index_to_coordinates[index]
+    return board.coordinates_to_index[CubeCoord(-coord.x, -coord.y, -coord.z)]
+
+
+def get_neighbors(board, index):
+    coord = board.index_to_coordinates[index]
+    return [board.coordinates_to_index.get(coord + direction, -1) for direction in DIRECTIONS]
+
+
+def get_initial_state(board, rng):
+    """Two small trees per player on the outer ring, the opponent's opposite to ours.
+
+    The game starts on day -1 with both players waiting so that the first get_next_state gathers the sun of day 0.
+    """
+    outer_ring = [cell.index for cell in board.cells[19:] if cell.richness > 0]
+    first = rng.choice(outer_ring)
+    second = rng.choice([index for index in outer_ring if index not in (first, get_opposite(board, first))])
+    indexes = (first, second)
+    trees = frozenset({Tree(index, 1, True, False) for index in indexes} |
+                      {Tree(get_opposite(board, index), 1, False, False) for index in indexes})
+    game_state = GameState(-1, 20, trees, Player(True, 0, 0, True), Player(False, 0, 0, True))
+    return game_state.get_next_state(WAIT, WAIT, board)
+
+
+def flip(game_state):
+    """The same game state seen by the opponent."""
+    trees = frozenset(Tree(tree.cell_index, tree.size, not tree.is_mine, tree.is_dormant) for tree in game_state.trees)
+    player, opponent = game_state.opponent, game_state.player
+    return GameState(game_state.day, game_state.nutrients, trees,
+                     Player(True, player.sun, player.score, player.is_waiting),
+                     Player(False, opponent.sun, opponent.score, opponent.is_waiting))
+
+
+def get_board_input(board):
+    lines = [str(len(board.cells))]
+    for cell in board.cells:
+        lines.append(' '.join(map(str, (cell.index, cell.richness, *get_neighbors(board, cell.index)))))
+    return lines
+
+
+def get_turn_input(game_state, possible_actions):
+    lines = [str(game_state.day), str(game_state.nutrients),
+             f'{game_state.player.sun} {game_state.player.score}',
+             f'{game_state.opponent.sun} {game_state.opponent.score} {int(game_state.opponent.is_waiting)}',
+             str(len(game_state.trees))]
+    lines += [f'{tree.cell_index} {tree.size} {int(tree.is_mine)} {int(tree.is_dormant)}' for tree in game_state.trees]
+    lines += [str(len(possible_actions))] + [action_to_string(action) for action in sorted(possible_actions)]
+    return lines
+
+
+def parse_action(line):
+    """The action at the start of the line, the rest is a message."""
+    words = line.split()
+    nb_words = {'WAIT': 1, 'GROW': 2, 'COMPLETE': 2, 'SEED': 3}.get(words[0] if words else '', 0)
+    return action_from_string(' '.join(words[:nb_words])) if nb_words else None
+
+
+def play_game(commands, seed, time_factor=1.):
+    rng = random.Random(seed)
+    board = get_random_board(rng)
+    game_state = get_initial_state(board, rng)
+    result = GameResult(seed)
+
+    with tempfile.TemporaryFile() as log_0, tempfile.TemporaryFile() as log_1:
+        bots = [Bot(commands[0], log_0), Bot(commands[1], log_1)]
+        try:
+            for bot in bots:
+                bot.send(get_board_input(board))
+
+            first_turn = True
+            while game_state.day < 24 and not result.is_forfeit():
+                views = (game_state, flip(game_state))
+                possible_actions = {index: view.get_possible_actions(board)[0]
+                                    for index, view in enumerate(views) if not view.player.is_waiting}
+                start_time = perf_counter_ns()
+                for index in possible_actions:
+                    try:
+                        bots[index].send(get_turn_input(views[index], possible_actions[index]))
+                    except OSError:
+                        pass  # Reported as a crash when reading its line
+                timeout = (STARTUP_TIME + FIRST_TURN_TIME * time_factor if first_turn else TURN_TIME * time_factor) + \
+                    GRACE_TIME
+                lines, latencies = receive_lines({index: bots[index] for index in possible_actions}, start_time,
+                                                 timeout)
+
+                actions, failures = [WAIT, WAIT], {}
+                for index in possible_actions:
+                    if index not in lines:
+                        failures[index] = 'timed out'
+                        continue
+                    result.latencies[index].append(latencies[index])
+                    if lines[index] is None:
+                        failures[index] = 'crashed'
+                        continue
+                    try:
+                        actions[index] = parse_action(lines[index])
+                    except KeyError:
+                        actions[index] = None
+                    if actions[index] not in possible_actions[index]:
+                        failures[index] = f'played {lines[index]!r}'
+
+                if failures:
+                    result.failures = tuple(f'{failures[index]} on day {game_state.day}' if index in failures else ''
+                                            for index in range(2))
+                else:
+                    game_state = game_state.get_next_state(actions[0], actions[1], board)
+                    first_turn = False
+        finally:
+            for bot in bots:
+                bot.close()
+
+        for index, log in enumerate((log_0, log_1)):
+            log.seek(0)
+            result.simulations[index].extend(map(int, SIMULATIONS_PATTERN.findall(log.read().decode(errors='replace'))))
+
+    if not result.is_forfeit():
+        result.scores = (game_state.player.get_score(), game_state.opponent.get_score())
+        nb_trees = (sum(tree.is_mine for tree in game_state.trees), sum(not tree.is_mine for tree in game_state.trees))
+        if result.scores[0] != result.scores[1]:
+            result.winner = 0 if result.scores[0] > result.scores[1] else 1
+        elif nb_trees[0] != nb_trees[1]:
+            result.winner = 0 if nb_trees[0] > nb_trees[1] else 1
+    return result
+
+
+def swap(result):
+    """The result seen from the second bot."""
+    return GameResult(result.seed, result.scores[::-1], None if result.winner is None else 1 - result.winner,
+                      result.failures[::-1], result.latencies[::-1], result.simulations[::-1])
+
+
+def get_wilson_interval(wins, games, z=1.96):
+    if games == 0:
+        return 0., 1.
+    p = wins / games
+    center = (p + z * z / (2 * games)) / (1 + z * z / games)
+    margin = z / (1 + z * z / games) * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games))
+    return center - margin, center + margin
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return math.nan
+    values = sorted(values)
+    return values[min(len(values) - 1, int(percentile / 100 * len(values)))]
+
+
+def run_arena(commands, nb_games, first_seed=0, nb_workers=None, time_factor=1.):
+    """Play nb_games between the two bots and return the results seen from the first one."""
+    with ProcessPoolExecutor(nb_workers) as executor:
+        futures = []
+        for seed in range(first_seed, first_seed + (nb_games + 1) // 2):
+            futures.append((False, executor.submit(play_game, commands, seed, time_factor)))
+            futures.append((True, executor.submit(play_game, commands[::-1], seed, time_factor)))
+        return [swap(future.result()) if swapped else future.result() for swapped, future in futures[:nb_games]]
+
+
+def print_report(commands, results):
+    forfeits = [result for result in results if result.is_forfeit()]
+    scored = [result for result in results if not result.is_forfeit()]
+    nb_games = len(scored)
+    wins = sum(result.winner == 0 for result in scored)
+    draws = sum(result.winner is None for result in scored)
+    low, high = get_wilson_interval(wins + draws / 2, nb_games)
+    print(f'{commands[0]} vs {commands[1]}: {wins} wins, {draws} draws, {nb_games - wins - draws} losses, '
+          f'{len(forfeits)} forfeits')
+    if nb_games:
+        print(f'Win rate {(wins + draws / 2) / nb_games:.1%}, 95% interval [{low:.1%}, {high:.1%}]')
+
+    for index, command in enumerate(commands):
+        latencies = [latency for result in results for latency in result.latencies[index][1:]]
+        simulations = [count for result in results for count in result.simulations[index]]
+        print(f'{command}:')
+        print('    latency ms  ' + '  '.join(f'p{percentile} {get_percentile(latencies, percentile):.1f}'
+                                            for percentile in (50, 90, 99, 100)))
+        if simulations:
+            print(f'    simulations mean {sum(simulations) / len(simulations):.0f}  '
+                  f'p10 {get_percentile(simulations, 10)}  p50 {get_percentile(simulations, 50)}')
+
+    if forfeits:
+        print('FORFEITS, not scored:')
+    for result in forfeits:
+        for command, failure in zip(commands, result.failures):
+            if failure:
+                print(f'    seed {result.seed}: {command} {failure}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('commands', nargs=2, help='Command lines of the two bots')
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0, help='First seed, each seed is played twice')
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 2))
+    parser.add_argument('--time-factor', type=float, default=1., help='Scale the turn time limits')
+    args = parser.parse_args()
+
+    results = run_arena(args.commands, args.games, args.seed, args.workers, args.time_factor)
+    print_report(args.commands, results)
+
+
+if __name__ == "__main__":
+    main()
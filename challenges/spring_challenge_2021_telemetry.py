@@ -0,0 +1,67 @@
+"""Summary of the search telemetry of a Spring Challenge 2021 game.
+
+Reads the JSON records that the bot writes each turn once TELEMETRY is set, from their file or from a whole stderr
+log whose other lines are skipped. Run it from this directory:
+    python spring_challenge_2021.py '{"TELEMETRY": "game.jsonl"}'
+    python spring_challenge_2021_telemetry.py game.jsonl
+"""
+import argparse
+import json
+from pathlib import Path
+
+PHASES = ('selection', 'expansion', 'transition', 'evaluation', 'backpropagation', 'overhead')
+
+
+def read_records(path):
+    records = []
+    for line in Path(path).read_text().splitlines():
+        if line.startswith('{'):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'times_ms' in record:
+                records.append(record)
+    return records
+
+
+def print_turns(records):
+    print(f'{"day":>3} {"source":8} {"action":12} {"sims":>6} {"created":>7} {"nodes":>7} {"depth":>9} '
+          f'{"root":>6} {"best":>5} {"ms":>7}')
+    for record in records:
+        player_actions = record.get('player_actions') or [('', 0, 0)]
+        root_visits = record.get('root_visits', 0)
+        best_share = player_actions[0][1] / root_visits if root_visits else 0
+        depth = f'{record["mean_depth"]:.1f}/{record["max_depth"]}'
+        print(f'{record["day"]:3} {record["source"]:8} {record["action"]:12} {record["simulations"]:6} '
+              f'{record["nodes_created"]:7} {record["nodes"]:7} {depth:>9} {root_visits:6} {best_share:5.0%} '
+              f'{record["turn_time_ms"]:7.1f}')
+
+
+def print_phases(records):
+    """Where the time of the searched turns goes, what the phases leave is parsing, rerooting and answering."""
+    searched = [record for record in records if record['source'] == 'search']
+    if not searched:
+        return
+    times = {phase: sum(record['times_ms'][phase] for record in searched) for phase in PHASES}
+    turn_time = sum(record['turn_time_ms'] for record in searched)
+    times['other'] = turn_time - sum(times.values())
+    nb_simulations = sum(record['simulations'] for record in searched)
+    print(f'{len(searched)} searched turns, {nb_simulations} simulations, '
+          f'{1000 * turn_time / max(1, nb_simulations):.0f} µs each:')
+    for phase, time in times.items():
+        print(f'    {phase:16} {time:9.1f} ms {time / turn_time:6.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='Telemetry file or stderr log of the bot')
+    args = parser.parse_args()
+
+    records = read_records(args.path)
+    print_turns(records)
+    print_phases(records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Self-play tuner of the Spring Challenge 2021 bot parameters.
+
+Samples variants of the parameters between the TUNED PARAMETERS markers of spring_challenge_2021.py and plays them
+against the bot as it is, with the local referee. Successive halving spends the games where they matter: each round,
+the surviving variants play the same new seeds in both seatings, the better half by win rate survives and the next
+round doubles the games. The last survivor plays a final round on its own, whose fresh seeds decide whether it beats
+the bot. Forfeited games are left out of the win rates, the tuning stops if too many games are forfeited, as the
+machine is then too slow for the time limits. Run it from this directory:
+    python spring_challenge_2021_tuner.py --variants 16 --games 8
+    python spring_challenge_2021_tuner.py --variants 16 --games 8 --write  # keep the winner if it beats the bot
+"""
+import argparse
+import ast
+import json
+import os
+import random
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from spring_challenge_2021_referee import get_wilson_interval, play_game, swap
+
+BOT_PATH = Path(__file__).with_name('spring_challenge_2021.py')
+TUNED_BLOCK_PATTERN = re.compile(r'(# BEGIN TUNED PARAMETERS[^\n]*\n)(.*?)(# END TUNED PARAMETERS)', re.DOTALL)
+# Ranges to sample from, a parameter with int bounds is an int
+PARAMETER_RANGES = {
+    'EXPLORATION_FACTOR': (1., 15.),
+    'FIRST_TURN_MAX_DEPTH': (3, 10),
+    'MAX_DEPTH': (2, 6),
+    'WIDENING_FACTOR': (0.5, 3.),
+    'WIDENING_EXPONENT': (0.2, 0.6),
+    'COMPLETE_PRIORITY_DAY': (6, 20),
+    'PRODUCTION_RATIO': (0.2, 1.),
+}
+MUTATION_RATE = 0.5  # Chance of each parameter of a variant to be sampled again, the others keep the bot's value
+MAX_FORFEIT_RATE = 0.1  # Share of forfeited games of a round above which the tuning stops, raise --time-factor then
+
+
+def read_parameters(path):
+    block = TUNED_BLOCK_PATTERN.search(path.read_text()).group(2)
+    parameters = {}
+    for line in block.splitlines():
+        name, value = line.split('=')
+        parameters[name.strip()] = ast.literal_eval(value.strip())
+    return parameters
+
+
+def write_parameters(path, parameters):
+    block = ''.join(f'{name} = {value!r}\n' for name, value in parameters.items())
+    source = path.read_text()
+    path.write_text(TUNED_BLOCK_PATTERN.sub(lambda match: match.group(1) + block + match.group(3), source, count=1))
+
+
+def get_variant(parameters, rng):
+    variant = dict(parameters)
+    for name, (low, high) in PARAMETER_RANGES.items():
+        if rng.random() < MUTATION_RATE:
+            variant[name] = rng.randint(low, high) if isinstance(low, int) else round(rng.uniform(low, high), 2)
+    return variant
+
+
+def get_command(parameters=None):
+    command = f'{shlex.quote(sys.executable)} {shlex.quote(str(BOT_PATH))}'
+    if parameters is not None:
+        command += ' ' + shlex.quote(json.dumps(parameters))
+    return command
+
+
+def play_round(executor, variants, seeds, time_factor):
+    """Points and games of each variant against the bot, each seed played in both seatings.
+
+    Forfeited games are not counted, too many of them raise an error.
+    """
+    bot_command = get_command()
+    futures = []
+    for index, variant in variants.items():
+        command = get_command(variant)
+        for seed in seeds:
+            futures.append((index, False, executor.submit(play_game, (command, bot_command), seed, time_factor)))
+            futures.append((index, True, executor.submit(play_game, (bot_command, command), seed, time_factor)))
+
+    scores = {index: [0., 0] for index in variants}
+    nb_forfeits = 0
+    for index, swapped, future in futures:
+        result = swap(future.result()) if swapped else future.result()
+        if result.is_forfeit():
+            nb_forfeits += 1
+            print(f'    seed {result.seed} forfeited: variant {result.failures[0] or "-"}, '
+                  f'bot {result.failures[1] or "-"}', file=sys.stderr)
+            continue
+        scores[index][0] += 1. if result.winner == 0 else 0.5 if result.winner is None else 0.
+        scores[index][1] += 1
+    if nb_forfeits > MAX_FORFEIT_RATE * len(futures):
+        raise RuntimeError(f'{nb_forfeits} of {len(futures)} games forfeited, raise --time-factor or lower --workers')
+    return scores
+
+
+def successive_halving(variants, nb_games, first_seed=0, nb_workers=None, time_factor=1.):
+    """Return the index of the best variant and its points and games of the final round."""
+    totals = {index: [0., 0] for index in range(len(variants))}
+    survivors = list(totals)
+    seed = first_seed
+    with ProcessPoolExecutor(nb_workers) as executor:
+        while True:
+            seeds = range(seed, seed + (nb_games + 1) // 2)
+            seed = seeds.stop
+            scores = play_round(executor, {index: variants[index] for index in survivors}, seeds, time_factor)
+            for index, (points, games) in scores.items():
+                totals[index][0] += points
+                totals[index][1] += games
+            survivors.sort(key=lambda index: totals[index][0] / max(1, totals[index][1]), reverse=True)
+
+            print(f'Round of {len(survivors)} variants, {2 * len(seeds)} games each:', file=sys.stderr)
+            for index in survivors:
+                points, games = totals[index]
+                print(f'    {points / max(1, games):6.1%} over {games:4} games  {json.dumps(variants[index])}',
+                      file=sys.stderr)
+
+            if len(survivors) == 1:
+                return survivors[0], scores[survivors[0]]
+            survivors = survivors[:len(survivors) // 2]
+            nb_games *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--variants', type=int, default=16)
+    parser.add_argument('--games', type=int, default=8, help='Games per variant in the first round')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the variants and first seed of the games')
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 2))
+    parser.add_argument('--time-factor', type=float, default=1., help='Scale the turn time limits')
+    parser.add_argument('--write', action='store_true', help='Write the winner to the bot if it beats it')
+    args = parser.parse_args()
+
+    parameters = read_parameters(BOT_PATH)
+    rng = random.Random(args.seed)
+    variants = [get_variant(parameters, rng) for _ in range(args.variants)]
+    best, (points, games) = successive_halving(variants, args.games, args.seed, args.workers, args.time_factor)
+
+    low, high = get_wilson_interval(points, games)
+    print(f'Best variant {json.dumps(variants[best])}')
+    print(f'Final round {points / max(1, games):.1%} over {games} games, 95% interval [{low:.1%}, {high:.1%}]')
+    if low <= 0.5:
+        print('It does not beat the bot significantly, keeping the current parameters.')
+    elif args.write:
+        write_parameters(BOT_PATH, variants[best])
+        print(f'Written to {BOT_PATH.name}.')
+
+
+if __name__ == "__main__":
+    main()
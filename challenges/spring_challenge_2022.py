@@ -1,12 +1,17 @@
 # See https://www.codingame.com/ide/challenge/spring-challenge-2022
 
+import itertools
+import math
 import sys
+import time
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from enum import Enum
 from functools import partial
 from typing import Optional, Union
 
+import numpy
+
 
 class EntityType(Enum):
     MONSTER = 0
@@ -152,6 +157,17 @@ BASE_VIEW = 6000
 HERO_VIEW = 2200
 TURN_LIMIT = 220
 MAP_SIZE = Point(17630, 9000)
+SHIELD_LIFE = 12
+SIMULATED_TURNS = 20  # Enough for a monster to cross the base radius, a simulated turn costs a few µs per entity
+FARM_COST = BASE_VIEW  # Added to the cost of farming a monster for mana, above the distance of any threat
+MANA_COST = 10  # Added per mana point in our base to the cost of farming, the less mana the more farming matters
+USE_BEAM_SEARCH = True  # Improve the actions of the strategies with a search over the joint actions of our heroes
+NB_CANDIDATES = 3  # Actions per hero, the planned one first: the search scores at most 3 + 2 * 9 joint actions
+BEAM_WIDTH = 3
+SEARCH_HORIZON = 2  # Simulated turns per joint action, a simulated turn costs up to a millisecond
+SEARCH_TIME = 0.02  # In seconds from the start of the turn, the strategies and the search share the 50 ms
+HEALTH_WEIGHT = 100  # Mana points a health point of a base is worth
+THREAT_WEIGHT = 10  # Mana points a health point of a monster at a base is worth, less the further it is
 
 
 def dist(a, b):
@@ -167,6 +183,48 @@ def get_position(distance, target, direction):
 Action = Union[ActionMove, ActionWait, ActionSpell]
 
 
+class EntityStore:
+    """Entities of a turn in parallel NumPy arrays, with the distances between all of them and both bases.
+
+    Rows are the entities in input order, the predicted monsters, then our base and the opponent base. Strategy
+    functions look distances up here rather than subtracting Points, so a turn costs one vectorized computation
+    whatever the number of monsters.
+    """
+
+    def __init__(self, entities, my_base: Base, opponent_base: Base, predicted_monsters=()):
+        self.entities = list(entities) + list(predicted_monsters)
+        self.indexes = {entity.id_: index for index, entity in enumerate(self.entities)}
+        self.base_indexes = {my_base.type_: len(self.entities), opponent_base.type_: len(self.entities) + 1}
+
+        points = [entity.position for entity in self.entities] + [my_base.position, opponent_base.position]
+        self.positions = numpy.array([(point.x, point.y) for point in points])
+        self.types = numpy.array([entity.type_.value for entity in self.entities], dtype=int)
+        self.shield_lives = numpy.array([entity.shield_life for entity in self.entities], dtype=int)
+        self.is_predicted = numpy.arange(len(self.entities)) >= len(self.entities) - len(predicted_monsters)
+
+        deltas = self.positions[:, numpy.newaxis] - self.positions[numpy.newaxis]
+        self.distances = numpy.hypot(deltas[..., 0], deltas[..., 1])
+        self.monster_indexes = numpy.flatnonzero(self.types == EntityType.MONSTER.value)
+
+    def get_index(self, item: Union[Base, Entity]):
+        return self.base_indexes[item.type_] if isinstance(item, Base) else self.indexes[item.id_]
+
+    def dist(self, a: Union[Base, Entity], b: Union[Base, Entity]):
+        return float(self.distances[self.get_index(a), self.get_index(b)])
+
+    def get_monsters_by_distance(self, origin: Union[Base, Entity], max_distance=math.inf, unshielded=False,
+                                 predicted=False):
+        """Monsters within max_distance of origin, closest first. Only the visible ones unless predicted is set."""
+        distances = self.distances[self.get_index(origin), self.monster_indexes]
+        selected = distances <= max_distance
+        if not predicted:
+            selected &= ~self.is_predicted[self.monster_indexes]
+        if unshielded:
+            selected &= self.shield_lives[self.monster_indexes] == 0
+        indexes = self.monster_indexes[selected][numpy.argsort(distances[selected], kind='stable')]
+        return [self.entities[index] for index in indexes]
+
+
 @dataclass
 class State:
     turn: int
@@ -175,12 +233,13 @@ class State:
     my_heroes: frozenset[Entity]
     opponent_heroes: frozenset[Entity]
     monsters: frozenset[Entity]
+    predicted_monsters: frozenset[Entity]
 
     available_heroes: set
     actions: dict[Entity, tuple[Action, str]]
     used_mana: int
 
-    def __init__(self, turn, my_base, opponent_base, entities):
+    def __init__(self, turn, my_base, opponent_base, entities, predicted_monsters=()):
         self.turn = turn
         self.my_base = my_base
         self.opponent_base = opponent_base
@@ -191,6 +250,9 @@ class State:
         self.my_heroes = frozenset(entities_by_type[EntityType.MY_HERO])
         self.opponent_heroes = frozenset(entities_by_type[EntityType.OPPONENT_HERO])
         self.monsters = frozenset(entities_by_type[EntityType.MONSTER])
+        self.predicted_monsters = frozenset(predicted_monsters)
+
+        self.store = EntityStore(entities, my_base, opponent_base, predicted_monsters)
 
         self.available_heroes = set(self.my_heroes)
         self.actions = {}
@@ -210,8 +272,18 @@ class State:
     def is_enough_mana(self, cost=SPELL_COST):
         return self.used_mana + cost <= self.my_base.mana
 
+    def dist(self, a: Union[Base, Entity], b: Union[Base, Entity]):
+        return self.store.dist(a, b)
+
+    def can_cast(self, caster: Entity, spell_range: int, target: Entity):
+        return not target.is_shielded() and self.dist(caster, target) <= spell_range
+
+    def get_predicted_threats(self):
+        """Monsters out of sight that should be heading for our base."""
+        return [monster for monster in self.predicted_monsters if monster.threat_for is BaseType.MY_BASE]
+
     def get_closest_hero(self, target: Union[Base, Entity]):
-        return min(self.available_heroes, key=partial(dist, target), default=None)
+        return min(self.available_heroes, key=partial(self.dist, target), default=None)
 
     def get_actions(self):
         default_action = ActionWait(), ""
@@ -219,79 +291,310 @@ class State:
                      for hero in sorted(self.my_heroes, key=lambda hero_: hero_.id_))
 
 
+@dataclass
+class Snapshot:
+    """Bases and entities of a simulated turn. Entities are frozen, the simulator replaces them."""
+    turn: int
+    my_base: Base
+    opponent_base: Base
+    entities: dict[str, Entity]
+
+    @classmethod
+    def from_state(cls, state: State, entities=None):
+        """Snapshot of the state, with only the given entities if any."""
+        if entities is None:
+            entities = state.my_heroes | state.opponent_heroes | state.monsters
+        return cls(state.turn, replace(state.my_base), replace(state.opponent_base),
+                   {entity.id_: entity for entity in entities})
+
+    def get_base(self, type_: Union[EntityType, BaseType]):
+        """Base of a hero type or base type."""
+        return self.my_base if type_ in (EntityType.MY_HERO, BaseType.MY_BASE) else self.opponent_base
+
+
+def get_threat_for(position: Point, velocity: Point, bases):
+    """Type of the base that a monster on this course enters, None if it misses them."""
+    speed = abs(velocity)
+    for base in bases:
+        relative_position = base.position - position
+        if abs(relative_position) <= BASE_RADIUS:
+            return base.type_
+        if speed:
+            # Closest point of the course to the base, not behind the monster
+            projection = max(0., (relative_position.value * velocity.value.conjugate()).real / speed ** 2)
+            if abs(relative_position - velocity * projection) <= BASE_RADIUS:
+                return base.type_
+    return None
+
+
+def move_towards(position: Point, target: Point, speed):
+    relative_position = target - position
+    distance = abs(relative_position)
+    return target if distance <= speed else position + relative_position * (speed / distance)
+
+
+def is_outside_map(position: Point):
+    return not (0 <= position.x <= MAP_SIZE.x and 0 <= position.y <= MAP_SIZE.y)
+
+
+def simulate_turn(snapshot: Snapshot, actions: dict[str, Action]):
+    """Snapshot of the next turn once heroes played their actions, by id.
+
+    Follows the referee: spells, hero moves, hero attacks, then monster moves and base damage. A controlled entity
+    steps towards its destination instead of its own move. Heroes without an action wait, monsters keep their course
+    and none spawns, the simulator does not know more.
+    """
+    entities = dict(snapshot.entities)
+    next_snapshot = Snapshot(snapshot.turn + 1, replace(snapshot.my_base), replace(snapshot.opponent_base), entities)
+    bases = (next_snapshot.my_base, next_snapshot.opponent_base)
+
+    # Spells, from the positions at the start of the turn. A spell without the mana or a valid target is not cast.
+    moves, controls = {}, {}
+    for hero_id, action in actions.items():
+        hero = snapshot.entities[hero_id]
+        base = next_snapshot.get_base(hero.type_)
+        if isinstance(action, ActionMove):
+            moves[hero_id] = action.position
+        if not isinstance(action, ActionSpell) or base.mana < SPELL_COST:
+            continue
+        if action.spell is Spell.WIND:
+            push = action.position - hero.position
+            if not abs(push):
+                continue
+            push *= WIND_PUSH / abs(push)
+            for target in snapshot.entities.values():
+                if target.type_ is not hero.type_ and can_cast(hero, WIND_RANGE, target):
+                    entities[target.id_] = replace(entities[target.id_], position=entities[target.id_].position + push)
+        else:
+            spell_range = SHIELD_RANGE if action.spell is Spell.SHIELD else CONTROL_RANGE
+            target = snapshot.entities.get(action.entity.id_)
+            if target is None or not can_cast(hero, spell_range, target):
+                continue
+            if action.spell is Spell.SHIELD:
+                entities[target.id_] = replace(entities[target.id_], shield_life=SHIELD_LIFE + 1)
+            else:
+                entities[target.id_] = replace(entities[target.id_], is_controlled=True)
+                controls[target.id_] = action.position
+        base.mana -= SPELL_COST
+
+    heroes = [entity for entity in entities.values() if entity.type_ is not EntityType.MONSTER]
+    for hero in heroes:
+        target = controls.get(hero.id_, moves.get(hero.id_))
+        if target is not None:
+            entities[hero.id_] = replace(hero, position=move_towards(hero.position, target, HERO_SPEED))
+
+    # Each hero hits every monster in range, each hit gives a mana
+    for hero in heroes:
+        hero = entities[hero.id_]
+        for monster in [entity for entity in entities.values() if entity.type_ is EntityType.MONSTER]:
+            if dist(hero, monster) <= HERO_RANGE:
+                next_snapshot.get_base(hero.type_).mana += 1
+                monster = replace(monster, health=monster.health - HERO_DAMAGE)
+                entities[monster.id_] = monster
+                if monster.health <= 0:
+                    del entities[monster.id_]
+
+    for monster in [entity for entity in entities.values() if entity.type_ is EntityType.MONSTER]:
+        velocity = monster.velocity
+        if monster.id_ in controls:
+            velocity = move_towards(monster.position, controls[monster.id_], MONSTER_SPEED) - monster.position
+        base = min(bases, key=partial(dist, monster))
+        near_base = dist(monster, base) <= BASE_RADIUS
+        if near_base and monster.id_ not in controls:
+            velocity = move_towards(monster.position, base.position, MONSTER_SPEED) - monster.position
+        position = monster.position + velocity
+        if abs(position - base.position) <= MONSTER_RANGE:
+            base.health -= 1
+            del entities[monster.id_]
+        elif is_outside_map(position) and not near_base:
+            del entities[monster.id_]
+        else:
+            entities[monster.id_] = replace(monster, position=position, velocity=velocity, near_base=near_base,
+                                            threat_for=get_threat_for(position, velocity, bases))
+
+    for entity_id, entity in entities.items():
+        if entity.shield_life or entity.is_controlled:
+            entities[entity_id] = replace(entity, shield_life=max(0, entity.shield_life - 1), is_controlled=False)
+    return next_snapshot
+
+
+def simulate(snapshot: Snapshot, get_plan_actions, nb_turns=SIMULATED_TURNS):
+    """Yield the snapshots of the next turns, get_plan_actions gives the actions of the heroes in a snapshot."""
+    for _ in range(nb_turns):
+        snapshot = simulate_turn(snapshot, get_plan_actions(snapshot))
+        yield snapshot
+
+
+@dataclass
+class Track:
+    entity: Entity
+    last_seen: int
+
+
+class EntityTracker:
+    """Monsters seen in the previous turns, by id, moved along their last course while they are out of sight.
+
+    A monster out of sight follows the simulator, so it turns towards a base it enters and is dropped once it leaves
+    the map or hits a base. It is dropped as well when it should be in sight but is not, killed or pushed away.
+    """
+
+    def __init__(self):
+        self.tracks: dict[str, Track] = {}
+
+    def update(self, turn, my_base: Base, opponent_base: Base, entities):
+        for entity in entities:
+            if entity.type_ is not EntityType.MONSTER:
+                continue
+            track = self.tracks.get(entity.id_)
+            if track is None:
+                self.tracks[entity.id_] = Track(entity, turn)
+            else:
+                track.entity, track.last_seen = entity, turn
+
+        unseen = {id_: track.entity for id_, track in self.tracks.items() if track.last_seen < turn}
+        snapshot = simulate_turn(Snapshot(turn - 1, my_base, opponent_base, unseen), {})
+        lookouts = [(my_base, BASE_VIEW)] + [(entity, HERO_VIEW) for entity in entities
+                                            if entity.type_ is EntityType.MY_HERO]
+        for id_ in unseen:
+            monster = snapshot.entities.get(id_)
+            if monster is None or any(dist(lookout, monster) <= view for lookout, view in lookouts):
+                del self.tracks[id_]
+            else:
+                self.tracks[id_].entity = monster
+
+    def get_predicted_monsters(self, turn):
+        return [track.entity for track in self.tracks.values() if track.last_seen < turn]
+
+
 def protect_heroes(state: State):
     for hero in state.my_heroes:
-        closest_opponent = min(state.opponent_heroes, key=partial(dist, hero), default=None)
-        closest_ally = min(state.available_heroes - {hero}, key=partial(dist, hero), default=None)
+        closest_opponent = min(state.opponent_heroes, key=partial(state.dist, hero), default=None)
+        closest_ally = min(state.available_heroes - {hero}, key=partial(state.dist, hero), default=None)
         if closest_opponent is None or closest_ally is None:
             continue
         if (
-                dist(closest_opponent, hero) < CONTROL_RANGE
-                and dist(closest_ally, hero) < SHIELD_RANGE
+                state.dist(closest_opponent, hero) < CONTROL_RANGE
+                and state.dist(closest_ally, hero) < SHIELD_RANGE
                 and not hero.is_shielded()
         ):
             state.add_action(closest_ally, ActionSpell(Spell.SHIELD, hero), "S")
 
 
-def control_threat(state: State, threat: Entity):
-    closest_hero = state.get_closest_hero(threat)
+def control_threat(state: State, hero: Entity, threat: Entity):
     return (
-            closest_hero is not None
-            and BASE_RADIUS < dist(threat, state.my_base)
+            BASE_RADIUS < state.dist(threat, state.my_base)
             and threat.health > 20
-            and can_cast(closest_hero, CONTROL_RANGE, threat)
-            and dist(threat, state.opponent_base) < dist(closest_hero, state.opponent_base)
-            and state.add_action(closest_hero,
+            and state.can_cast(hero, CONTROL_RANGE, threat)
+            and state.dist(threat, state.opponent_base) < state.dist(hero, state.opponent_base)
+            and state.add_action(hero,
                                  ActionSpell(Spell.CONTROL, entity=threat, position=state.opponent_base.position),
                                  f"C{threat.id_}")
     )
 
 
-def push_threat(state, threat: Entity):
-    closest_hero = state.get_closest_hero(threat)
+def push_threat(state, hero: Entity, threat: Entity):
     return (
-            closest_hero is not None
-            and BASE_RADIUS - WIND_PUSH < dist(threat, state.my_base) < BASE_RADIUS
-            and can_cast(closest_hero, WIND_RANGE, threat)
-            and state.add_action(closest_hero,
+            BASE_RADIUS - WIND_PUSH < state.dist(threat, state.my_base) < BASE_RADIUS
+            and state.can_cast(hero, WIND_RANGE, threat)
+            and state.add_action(hero,
                                  ActionSpell(Spell.WIND, position=threat.position * 2 - state.my_base.position),
                                  f"W{threat.id_}")
     )
 
 
-def attack_threat(state: State, threat: Entity):
-    damage_done = 0
-    while damage_done < threat.health:
-        closest_hero = state.get_closest_hero(threat)
-        if closest_hero is None:
-            return
-        state.add_action(closest_hero, ActionMove(threat.position), f"A{threat.id_}")
+def is_killed_in_time(state: State, threat: Entity, attackers):
+    """Whether the attackers chasing the threat kill it before it hits our base, without the other entities."""
+    def chase(snapshot):
+        monster = snapshot.entities[threat.id_]
+        return {hero.id_: ActionMove(monster.position) for hero in attackers}
 
-        turns_to_base = max(0, dist(state.my_base, threat) - MONSTER_RANGE) // MONSTER_SPEED
-        turns_to_threat = max(0, dist(threat, closest_hero) - HERO_RANGE) // (HERO_SPEED - MONSTER_SPEED)
-        damage_done += HERO_DAMAGE * max(0, turns_to_base - turns_to_threat)
+    for snapshot in simulate(Snapshot.from_state(state, [threat, *attackers]), chase):
+        if threat.id_ not in snapshot.entities:
+            return snapshot.my_base.health == state.my_base.health
+    return False
 
 
-def target_threats(state: State):
-    threats = filter(lambda monster_: monster_.threat_for is BaseType.MY_BASE, state.monsters)
-    threats = sorted(threats, key=partial(dist, state.my_base))
-    for threat in threats:
-        (
-                control_threat(state, threat)
-                or push_threat(state, threat)
-                or attack_threat(state, threat)
-        )
+def get_nb_attackers(state: State, threat: Entity, deadline=math.inf):
+    """Number of the closest available heroes that must chase the threat to kill it before it hits our base.
 
+    Each guess is checked by simulating the chase, the last guess stands once past the deadline.
+    """
+    attackers = sorted(state.available_heroes, key=partial(state.dist, threat))
+    for nb_attackers in range(1, len(attackers)):
+        if time.perf_counter() > deadline or is_killed_in_time(state, threat, attackers[:nb_attackers]):
+            return nb_attackers
+    return len(attackers)
 
-def gain_mana(state: State):
-    monsters = sorted(state.monsters, key=partial(dist, state.my_base))
-    for monster in monsters:
-        if dist(state.my_base, monster) > 2 * BASE_RADIUS:
-            return
-        closest_hero = state.get_closest_hero(monster)
-        if closest_hero is None:
-            return
-        state.add_action(closest_hero, ActionMove(monster.position), f"M{monster.id_}")
+
+@dataclass(frozen=True)
+class Task:
+    monster: Entity
+    is_threat: bool
+    cost: float  # Cost of the task itself, the heroes add the distance they have to cover
+
+
+def get_tasks(state: State, deadline=math.inf):
+    """Tasks on the monsters, closest first: as many as the attackers each threat needs, one per predicted threat to
+    meet and one per monster to farm."""
+    tasks = []
+    for monster in state.store.get_monsters_by_distance(state.my_base, predicted=True):
+        distance = state.dist(monster, state.my_base)
+        if monster in state.predicted_monsters:
+            if monster.threat_for is BaseType.MY_BASE:
+                tasks.append(Task(monster, True, distance))
+        elif monster.threat_for is BaseType.MY_BASE:
+            tasks.extend(Task(monster, True, distance) for _ in range(get_nb_attackers(state, monster, deadline)))
+        elif distance <= 2 * BASE_RADIUS:
+            tasks.append(Task(monster, False, FARM_COST + distance + MANA_COST * state.my_base.mana))
+    return tasks
+
+
+def get_task_cost(state: State, hero: Entity, task: Task):
+    return max(0., state.dist(hero, task.monster) - HERO_RANGE) + task.cost
+
+
+def get_min_cost_assignment(costs):
+    """Pairs of a row and a distinct column of the costs, as many as the smaller side allows, for the least total.
+
+    There are few heroes, an exact search over the permutations is enough. It only tries the nb_rows cheapest
+    columns of each row: one of them is always left free by the other rows, so an optimal assignment uses no other.
+    """
+    nb_rows, nb_columns = len(costs), len(costs[0])
+    if nb_rows > nb_columns:
+        return [(row, column) for column, row in get_min_cost_assignment(list(zip(*costs)))]
+    candidates = sorted({column for row_costs in costs
+                         for column in sorted(range(nb_columns), key=row_costs.__getitem__)[:nb_rows]})
+    columns = min(itertools.permutations(candidates, nb_rows),
+                  key=lambda columns_: sum(row_costs[column] for row_costs, column in zip(costs, columns_)))
+    return list(enumerate(columns))
+
+
+def assign_tasks(state: State, deadline=math.inf):
+    """Give the threats and the monsters to farm to the available heroes, for the least total cost.
+
+    The first hero of a threat casts a spell on it when it can, the other heroes of the threat are then left free.
+    A predicted threat is out of sight, its hero heads for where it should be next turn.
+    """
+    heroes = sorted(state.available_heroes, key=lambda hero_: hero_.id_)
+    tasks = get_tasks(state, deadline)
+    if not heroes or not tasks:
+        return
+
+    costs = [[get_task_cost(state, hero, task) for task in tasks] for hero in heroes]
+    cast_on = set()
+    for hero_index, task_index in sorted(get_min_cost_assignment(costs), key=lambda pair: pair[1]):
+        hero, task = heroes[hero_index], tasks[task_index]
+        monster = task.monster
+        if not task.is_threat:
+            state.add_action(hero, ActionMove(monster.position), f"M{monster.id_}")
+        elif monster in state.predicted_monsters:
+            state.add_action(hero, ActionMove(monster.position + monster.velocity), f"P{monster.id_}")
+        elif monster.id_ in cast_on:
+            continue
+        elif control_threat(state, hero, monster) or push_threat(state, hero, monster):
+            cast_on.add(monster.id_)
+        else:
+            state.add_action(hero, ActionMove(monster.position), f"A{monster.id_}")
 
 
 def move_to_defense(state: State):
@@ -304,7 +607,7 @@ def move_to_defense(state: State):
 
 
 def move_to_attack(state: State, hero: Entity):
-    if dist(hero, state.opponent_base) > BASE_RADIUS:
+    if state.dist(hero, state.opponent_base) > BASE_RADIUS:
         center = (state.my_base.position + state.opponent_base.position) * .5
         target_position = get_position(BASE_RADIUS, state.opponent_base.position, center)
         state.add_action(hero, ActionMove(target_position), f"M")
@@ -313,7 +616,7 @@ def move_to_attack(state: State, hero: Entity):
 
 
 def push_attack(state: State, hero: Entity):
-    monsters_in_range = {monster for monster in state.monsters if can_cast(hero, WIND_RANGE, monster)}
+    monsters_in_range = state.store.get_monsters_by_distance(hero, WIND_RANGE, unshielded=True)
     return (
             len(monsters_in_range) >= 5
             and state.add_action(hero, ActionSpell(Spell.WIND, position=state.opponent_base.position), "P")
@@ -321,8 +624,7 @@ def push_attack(state: State, hero: Entity):
 
 
 def control_attack(state: State, hero: Entity):
-    closest_monster = min((monster for monster in state.monsters if can_cast(hero, CONTROL_RANGE, monster)),
-                          key=partial(dist, hero), default=None)
+    closest_monster = next(iter(state.store.get_monsters_by_distance(hero, CONTROL_RANGE, unshielded=True)), None)
     return (
             closest_monster
             and state.add_action(hero, ActionSpell(Spell.CONTROL, entity=closest_monster,
@@ -341,16 +643,94 @@ def attack_opponent(state: State):
     )
 
 
-def get_actions(state: State):
+def get_candidate_actions(state: State, hero: Entity):
+    """The planned action of the hero, then moves to the closest monsters and a wind towards the opponent base.
+
+    The wind is only a candidate if the mana left by the spells of the other heroes pays for it.
+    """
+    candidates = [state.actions.get(hero, (ActionWait(), ""))]
+    monsters = state.store.get_monsters_by_distance(hero, HERO_VIEW)
+    # A planned spell of the hero is replaced by the wind, its mana is already counted
+    cost = 0 if isinstance(candidates[0][0], ActionSpell) else SPELL_COST
+    if state.is_enough_mana(cost) and any(state.can_cast(hero, WIND_RANGE, monster) for monster in monsters):
+        candidates.append((ActionSpell(Spell.WIND, position=state.opponent_base.position), "BW"))
+    candidates.extend((ActionMove(monster.position), f"B{monster.id_}") for monster in monsters)
+    return candidates[:NB_CANDIDATES]
+
+
+def get_search_snapshot(state: State):
+    """Snapshot of our heroes and the monsters that matter in the horizon, fewer entities to simulate."""
+    reach = HERO_VIEW + SEARCH_HORIZON * HERO_SPEED
+    monsters = {*state.store.get_monsters_by_distance(state.my_base, BASE_VIEW),
+                *state.store.get_monsters_by_distance(state.opponent_base, BASE_VIEW)}
+    for hero in state.my_heroes:
+        monsters.update(state.store.get_monsters_by_distance(hero, reach))
+    return Snapshot.from_state(state, [*state.my_heroes, *monsters])
+
+
+def evaluate(snapshot: Snapshot):
+    """Score of a snapshot for us, in mana points."""
+    score = HEALTH_WEIGHT * (snapshot.my_base.health - snapshot.opponent_base.health) + snapshot.my_base.mana
+    for monster in snapshot.entities.values():
+        if monster.type_ is not EntityType.MONSTER or monster.threat_for is None:
+            continue
+        base = snapshot.get_base(monster.threat_for)
+        danger = THREAT_WEIGHT * monster.health * max(0., 1. - dist(monster, base) / BASE_VIEW)
+        score += -danger if monster.threat_for is BaseType.MY_BASE else danger
+    return score
+
+
+def evaluate_joint_action(snapshot: Snapshot, actions: dict[str, Action]):
+    """Score after SEARCH_HORIZON turns, the heroes keep moving to their destination after the first one."""
+    moves = {hero_id: action for hero_id, action in actions.items() if isinstance(action, ActionMove)}
+    for _ in range(SEARCH_HORIZON):
+        snapshot = simulate_turn(snapshot, actions)
+        actions = moves
+    return evaluate(snapshot)
+
+
+def search_joint_action(state: State, deadline):
+    """Replace the planned actions of our heroes by the best joint action that a beam search finds.
+
+    Heroes are decided one after the other: each joint action of the beam is extended with every candidate of the next
+    hero, the heroes still to decide keeping their planned action, and the best BEAM_WIDTH extensions remain. Past the
+    deadline, the heroes not decided yet keep their planned action.
+    """
+    heroes = sorted(state.my_heroes, key=lambda hero_: hero_.id_)
+    planned = [state.actions.get(hero, (ActionWait(), "")) for hero in heroes]
+    candidates = [get_candidate_actions(state, hero) for hero in heroes]
+    snapshot = get_search_snapshot(state)
+
+    beam = [()]
+    for depth in range(len(heroes)):
+        if time.perf_counter() > deadline:
+            break
+        scored = []
+        for prefix, candidate in itertools.product(beam, candidates[depth]):
+            if scored and time.perf_counter() > deadline:
+                break
+            joint_action = prefix + (candidate,) + tuple(planned[depth + 1:])
+            actions = {hero.id_: action for hero, (action, _) in zip(heroes, joint_action)}
+            scored.append((evaluate_joint_action(snapshot, actions), prefix + (candidate,)))
+        # Stable sort, the planned actions win ties
+        scored.sort(key=lambda item: item[0], reverse=True)
+        beam = [prefix for _, prefix in scored[:BEAM_WIDTH]]
+
+    state.actions.update(zip(heroes, beam[0] + tuple(planned[len(beam[0]):])))
+
+
+def get_actions(state: State, deadline=math.inf):
     protect_heroes(state)
 
     if state.turn > TURN_LIMIT // 2:
         attack_opponent(state)
 
-    target_threats(state)
-    gain_mana(state)
+    assign_tasks(state, deadline)
     move_to_defense(state)
 
+    if USE_BEAM_SEARCH:
+        search_joint_action(state, deadline)
+
     return state.get_actions()
 
 
@@ -360,17 +740,22 @@ def main():
     heroes_per_player = int(input())
     log(heroes_per_player)
 
+    tracker = EntityTracker()
+
     # game loop
     turn = 0
     while True:
         turn += 1
         my_base.health, my_base.mana = map(int, input().split())
+        deadline = time.perf_counter() + SEARCH_TIME
         opponent_base.health, opponent_base.mana = map(int, input().split())
         entities = [Entity.from_string(input()) for _ in range(int(input()))]
 
-        state = State(turn, my_base, opponent_base, entities)
+        tracker.update(turn, my_base, opponent_base, entities)
+
+        state = State(turn, my_base, opponent_base, entities, tracker.get_predicted_monsters(turn))
 
-        for action, message in get_actions(state):
+        for action, message in get_actions(state, deadline):
             print(action, message)
 
 
@@ -1,16 +1,91 @@
 # See https://www.codingame.com/ide/puzzle/amazons
+import math
 import sys
 from enum import Enum
 from random import choice
-from time import perf_counter
+from statistics import NormalDist
+from time import perf_counter_ns
 
 from typing import NamedTuple, Iterable, Optional
 
+ALLOWED_TIME = 90E6
+CHECK_PERIOD = 4  # Walls evaluated between two reads of the clock, about 0.4 ms each
+
 
 def debug(*msg):
     print(*msg, file=sys.stderr, flush=True)
 
 
+# BEGIN BUNDLED ../challenges/spring_challenge_2021/time_budget.py by merge.py --embed, edit that module instead
+
+
+class TimeBudget:
+    """Tell a search loop when to stop so that it answers before its deadline.
+
+    The cost of a batch of check_period iterations is learned online as an exponentially weighted mean and variance,
+    kept from one turn to the next. The loop stops once the next batch would overrun the deadline with a probability
+    above 1 - quantile. The clock is only read every check_period calls to is_over(), the cheap over attribute tells
+    the outer loops of a nested search that the inner one stopped.
+    """
+
+    def __init__(self, quantile=0.99, check_period=1, smoothing=0.1):
+        self.z_score = NormalDist().inv_cdf(quantile)
+        self.check_period = check_period
+        self.smoothing = smoothing
+        self.mean = None
+        self.variance = 0.
+        self.start()
+
+    def start(self, duration=math.inf, start_time=None):
+        """Start a turn of duration ns, from start_time if the clock started earlier than now."""
+        self.start_time = perf_counter_ns() if start_time is None else start_time
+        self.deadline = self.start_time + duration
+        self.last_time = self.start_time
+        self.countdown = 1  # The first call checks the clock
+        self.nb_checks = 0
+        self.over = False
+
+    def is_over(self):
+        """Call before each iteration. Return whether the loop must stop."""
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.check_period
+
+        now = perf_counter_ns()
+        if self.nb_checks:
+            self.add_sample(now - self.last_time)
+        self.nb_checks += 1
+        self.last_time = now
+        self.over = now + self.get_margin() > self.deadline
+        return self.over
+
+    def add_sample(self, cost):
+        if self.mean is None:
+            # A single sample says nothing of the spread, assume it is as large as the cost
+            self.mean, self.variance = cost, cost * cost
+            return
+        delta = cost - self.mean
+        self.mean += self.smoothing * delta
+        self.variance = (1 - self.smoothing) * (self.variance + self.smoothing * delta * delta)
+
+    def get_margin(self):
+        """Time to keep for the next batch of iterations."""
+        if self.mean is None:
+            return 0
+        return self.mean + self.z_score * math.sqrt(self.variance)
+
+    def log(self):
+        used = self.last_time - self.start_time
+        unused = self.deadline - self.last_time
+        cost = (self.mean or 0) / self.check_period
+        print(f'Used {used / 1E6:.1f} ms, {unused / 1E6:.1f} ms unused. '
+              f'Iteration cost {cost / 1E6:.3f} ms, margin {self.get_margin() / 1E6:.3f} ms.', file=sys.stderr)
+
+
+# END BUNDLED
+
+
 class Color(str, Enum):
     WHITE = "w"
     BLACK = "b"
@@ -68,7 +143,7 @@ class Board(NamedTuple):
                 else:
                     break
 
-    def get_move(self, color: Color):
+    def get_move(self, color: Color, time_budget: TimeBudget):
         my_positions = {Position(row, col)
                         for row, line in enumerate(self.grid) for col, cell in enumerate(line)
                         if cell == color}
@@ -77,19 +152,19 @@ class Board(NamedTuple):
                               if cell == color.opposite}
 
         scores = {}
-        end_time = perf_counter() + 0.09
+        time_budget.start(ALLOWED_TIME)
         for position in my_positions:
-            if perf_counter() > end_time:
+            if time_budget.over:
                 break
             my_positions.remove(position)
             self.grid[position.row][position.col] = '.'
             for new_position in self.get_available_cells(position):
-                if perf_counter() > end_time:
+                if time_budget.over:
                     break
                 self.grid[new_position.row][new_position.col] = color.value
                 my_positions.add(new_position)
                 for wall_position in self.get_available_cells(new_position):
-                    if perf_counter() > end_time:
+                    if time_budget.is_over():
                         break
                     self.grid[wall_position.row][wall_position.col] = '-'
                     score = (sum(len(list(self.get_available_cells(p))) for p in my_positions)
@@ -101,6 +176,8 @@ class Board(NamedTuple):
             self.grid[position.row][position.col] = color.value
             my_positions.add(position)
 
+        debug(f'{len(scores)} moves')
+        time_budget.log()
         best_score = max(scores.values())
         best_actions = [action for action, score in scores.items() if score == best_score]
         return choice(best_actions)
@@ -108,6 +185,7 @@ class Board(NamedTuple):
 
 def main():
     board_size = int(input())
+    time_budget = TimeBudget(check_period=CHECK_PERIOD)
 
     while True:
         color = Color(input())
@@ -116,7 +194,7 @@ def main():
         actions_count = int(input())
         debug(last_action, actions_count)
 
-        print(board.get_move(color))
+        print(board.get_move(color, time_budget))
 
 
 if __name__ == "__main__":
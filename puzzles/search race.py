@@ -4,12 +4,12 @@
 import sys
 import math
 import cmath
-from time import perf_counter
 from random import random
+from statistics import NormalDist
+from time import perf_counter_ns
 
 BEAM_WIDTH = 80
-ALLOWED_TIME = 0.050
-STOP_FACTOR = 2
+ALLOWED_TIME = 50E6
 
 
 def debug(*msg):
@@ -17,6 +17,76 @@ def debug(*msg):
     print(*msg, file=sys.stderr, flush=True)
 
 
+# BEGIN BUNDLED ../challenges/spring_challenge_2021/time_budget.py by merge.py --embed, edit that module instead
+
+
+class TimeBudget:
+    """Tell a search loop when to stop so that it answers before its deadline.
+
+    The cost of a batch of check_period iterations is learned online as an exponentially weighted mean and variance,
+    kept from one turn to the next. The loop stops once the next batch would overrun the deadline with a probability
+    above 1 - quantile. The clock is only read every check_period calls to is_over(), the cheap over attribute tells
+    the outer loops of a nested search that the inner one stopped.
+    """
+
+    def __init__(self, quantile=0.99, check_period=1, smoothing=0.1):
+        self.z_score = NormalDist().inv_cdf(quantile)
+        self.check_period = check_period
+        self.smoothing = smoothing
+        self.mean = None
+        self.variance = 0.
+        self.start()
+
+    def start(self, duration=math.inf, start_time=None):
+        """Start a turn of duration ns, from start_time if the clock started earlier than now."""
+        self.start_time = perf_counter_ns() if start_time is None else start_time
+        self.deadline = self.start_time + duration
+        self.last_time = self.start_time
+        self.countdown = 1  # The first call checks the clock
+        self.nb_checks = 0
+        self.over = False
+
+    def is_over(self):
+        """Call before each iteration. Return whether the loop must stop."""
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.check_period
+
+        now = perf_counter_ns()
+        if self.nb_checks:
+            self.add_sample(now - self.last_time)
+        self.nb_checks += 1
+        self.last_time = now
+        self.over = now + self.get_margin() > self.deadline
+        return self.over
+
+    def add_sample(self, cost):
+        if self.mean is None:
+            # A single sample says nothing of the spread, assume it is as large as the cost
+            self.mean, self.variance = cost, cost * cost
+            return
+        delta = cost - self.mean
+        self.mean += self.smoothing * delta
+        self.variance = (1 - self.smoothing) * (self.variance + self.smoothing * delta * delta)
+
+    def get_margin(self):
+        """Time to keep for the next batch of iterations."""
+        if self.mean is None:
+            return 0
+        return self.mean + self.z_score * math.sqrt(self.variance)
+
+    def log(self):
+        used = self.last_time - self.start_time
+        unused = self.deadline - self.last_time
+        cost = (self.mean or 0) / self.check_period
+        print(f'Used {used / 1E6:.1f} ms, {unused / 1E6:.1f} ms unused. '
+              f'Iteration cost {cost / 1E6:.3f} ms, margin {self.get_margin() / 1E6:.3f} ms.', file=sys.stderr)
+
+
+# END BUNDLED
+
+
 def apply(node, action, checkpoints):
     checkpoint_index, _, _, _, position, velocity, direction = node
     angle, thrust = action
@@ -36,8 +106,8 @@ def apply(node, action, checkpoints):
         return checkpoint_index, 0, 0, random(), position, velocity, direction
 
 
-def get_action(checkpoints, checkpoint_index, car):
-    start_time = perf_counter()
+def get_action(checkpoints, checkpoint_index, car, time_budget):
+    time_budget.start(ALLOWED_TIME)
     x, y, vx, vy, angle = car
     position = x + y * 1j
     velocity = vx + vy * 1j
@@ -51,7 +121,7 @@ def get_action(checkpoints, checkpoint_index, car):
         nodes[apply(start_node, action, checkpoints)] = action
 
     steps = 1
-    while (perf_counter() - start_time) * (1 + STOP_FACTOR / steps) < ALLOWED_TIME:
+    while not time_budget.is_over():
         new_nodes = {}
         for node in sorted(nodes)[:BEAM_WIDTH]:
             for action in valid_actions:
@@ -73,12 +143,14 @@ def get_action(checkpoints, checkpoint_index, car):
 def main():
     checkpoints = tuple(x + 1j * y for x, y in (map(int, input().split()) for _ in range(int(input())))) * 3
     debug(checkpoints)
+    # A beam step costs a few ms, so the clock is read before each one
+    time_budget = TimeBudget()
 
     while True:
         checkpoint_index, *car = map(int, input().split())
         debug(checkpoint_index, car)
 
-        rotation_angle, thrust, message = get_action(checkpoints, checkpoint_index, car)
+        rotation_angle, thrust, message = get_action(checkpoints, checkpoint_index, car, time_budget)
         print(f'EXPERT {rotation_angle} {thrust} {message}')
 
 